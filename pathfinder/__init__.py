@@ -1 +1,2 @@
 from .pathfinder import *
+from .pathfinder import __getattr__
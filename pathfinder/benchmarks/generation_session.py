@@ -0,0 +1,121 @@
+"""
+Micro-benchmark of the per-call setup of Model._get_gen/_get_find/_get_select,
+loading the configs on every call (before GenerationSession) vs. resolving them
+once in a GenerationSession.
+
+Runs offline on a tiny randomly initialized GPT-2 saved to a temporary directory:
+
+    python -m pathfinder.benchmarks.generation_session --calls 1000
+"""
+
+import argparse
+import tempfile
+import timeit
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import (
+    AutoConfig,
+    GenerationConfig,
+    GPT2Config,
+    GPT2LMHeadModel,
+    PreTrainedTokenizerFast,
+)
+
+from pathfinder.pathfinder._gen import gen
+from pathfinder.pathfinder.model import GenerationSession
+
+
+def build_model(path):
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=300,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        special_tokens=["</s>"],
+    )
+    tokenizer.train_from_iterator(["How many tons of fish would you catch?"], trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="</s>")
+
+    config = GPT2Config(
+        vocab_size=len(tokenizer),
+        n_layer=1,
+        n_head=1,
+        n_embd=8,
+        bos_token_id=0,
+        eos_token_id=0,
+    )
+    model = GPT2LMHeadModel(config)
+    model.save_pretrained(path)
+    model.generation_config.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return model, tokenizer
+
+
+def setup_per_call(model, tokenizer, value):
+    """Setup work of a gen/find + select call before GenerationSession."""
+    generation_config = GenerationConfig.from_pretrained(model.name_or_path)
+    pad_token_id = generation_config.pad_token_id
+    eos_token_id = generation_config.eos_token_id
+    if eos_token_id is None:
+        eos_token_id = tokenizer.eos_token_id
+    if pad_token_id is None:
+        pad_token_id = (
+            eos_token_id[0] if isinstance(eos_token_id, list) else eos_token_id
+        )
+    generation_config.update(
+        pad_token_id=pad_token_id,
+        eos_token_id=eos_token_id,
+        max_new_tokens=value.max_tokens,
+        do_sample=False,
+        temperature=1.0,
+        top_p=1.0,
+    )
+    tokenizer.decode(eos_token_id)
+
+    model_config = AutoConfig.from_pretrained(model.name_or_path)
+    GenerationConfig(
+        pad_token_id=model_config.pad_token_id or model_config.eos_token_id,
+        eos_token_id=model_config.eos_token_id,
+        max_new_tokens=1,
+        return_dict_in_generate=True,
+        output_scores=True,
+        renormalize_logits=True,
+    )
+
+
+def setup_session(session, value):
+    """Setup work of a gen/find + select call with a GenerationSession."""
+    session.generation_config_for(value)
+    session.strip_eos("")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    value = gen(max_tokens=100, stop_regex=r"Answer:")
+    with tempfile.TemporaryDirectory() as path:
+        model, tokenizer = build_model(path)
+        model.name_or_path = path
+
+        before = timeit.timeit(
+            lambda: setup_per_call(model, tokenizer, value), number=args.calls
+        )
+        start = timeit.default_timer()
+        session = GenerationSession(model, tokenizer)
+        build = timeit.default_timer() - start
+        after = timeit.timeit(lambda: setup_session(session, value), number=args.calls)
+
+    print(
+        f"per-call setup, configs loaded on every call: {before / args.calls * 1e6:.1f} us"
+    )
+    print(
+        f"per-call setup, GenerationSession:            {after / args.calls * 1e6:.1f} us"
+    )
+    print(f"GenerationSession construction (once):        {build * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
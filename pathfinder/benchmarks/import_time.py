@@ -0,0 +1,85 @@
+"""
+Benchmark of the startup cost of the packages: each module is imported in a fresh
+interpreter with `python -X importtime`, and must stay under its time budget
+without importing the heavy backends (torch, transformers, vllm, ...).
+
+    python -m pathfinder.benchmarks.import_time
+    python -m pathfinder.benchmarks.import_time --module pathfinder --budget 0.5
+
+Exits with status 1 if a module is over budget or imports a heavy backend.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# module -> budget (s) of its cumulative import time
+BUDGETS = {
+    "pathfinder": 0.5,
+    "simulation.main": 3.0,
+}
+HEAVY_MODULES = ["torch", "transformers", "vllm", "sentence_transformers"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _run(code):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=ROOT,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"{code} failed:\n{out.stderr}")
+    # lines are "import time: self [us] | cumulative | imported package", nested
+    # imports are indented and reported before their parent
+    imports = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports[name.strip()] = int(cumulative)
+    return imports, out.stdout
+
+
+def import_time(module):
+    """Cumulative import time (s) of `module` and the heavy modules it imported."""
+    startup, _ = _run("pass")
+    imports, stdout = _run(
+        f"import sys, {module}\n"
+        f"print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules], sep=',')"
+    )
+    seconds = sum(t for name, t in imports.items() if name not in startup) / 1e6
+    heavy = stdout.splitlines()[-1] if stdout.strip() else ""
+    return seconds, [m for m in heavy.split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", action="append")
+    parser.add_argument("--budget", type=float, default=None)
+    args = parser.parse_args()
+
+    modules = args.module or list(BUDGETS)
+    ok = True
+    for module in modules:
+        budget = args.budget if args.budget is not None else BUDGETS.get(module, 1.0)
+        seconds, heavy = import_time(module)
+        status = "ok" if seconds <= budget and not heavy else "FAIL"
+        ok = ok and status == "ok"
+        print(
+            f"{module:30s} {seconds * 1e3:8.1f} ms (budget {budget * 1e3:.0f} ms)"
+            f"  heavy: {', '.join(heavy) or '-'}  {status}"
+        )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
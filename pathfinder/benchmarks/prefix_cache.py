@@ -0,0 +1,75 @@
+"""
+Benchmark of the radix KV cache of GenerationSession: personas sharing a long
+system prompt each generate a short answer, with and without the cache.
+
+Runs offline on a small randomly initialized GPT-2 saved to a temporary directory:
+
+    python -m pathfinder.benchmarks.prefix_cache --personas 20
+"""
+
+import argparse
+import tempfile
+import time
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from pathfinder import assistant, gen, system, user
+from pathfinder.benchmarks.generation_session import build_model
+from pathfinder.pathfinder.model import GenerationSession, Model
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+def run(model, tokenizer, session, personas):
+    lm = Model(model, tokenizer, template=TEMPLATE, session=session)
+    with system():
+        lm += "How many tons of fish would you catch? " * 100
+    start = time.perf_counter()
+    for i in range(personas):
+        persona = lm
+        with user():
+            persona += f"Persona {i}: how many tons?"
+        with assistant():
+            persona += gen(max_tokens=8, stop_regex=r"\n", name="answer")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--personas", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        _, tokenizer = build_model(path)
+        torch.manual_seed(0)
+        config = GPT2Config(
+            vocab_size=len(tokenizer),
+            n_layer=6,
+            n_head=8,
+            n_embd=256,
+            n_positions=2048,
+            bos_token_id=0,
+            eos_token_id=0,
+        )
+        model = GPT2LMHeadModel(config).eval()
+        model.save_pretrained(path)
+        model.generation_config.save_pretrained(path)
+        model.name_or_path = path
+
+        uncached = GenerationSession(model, tokenizer, reuse_kv_cache=False)
+        cached = GenerationSession(model, tokenizer)
+        run(model, tokenizer, uncached, 1)  # warm up
+        without_cache = run(model, tokenizer, uncached, args.personas)
+        with_cache = run(model, tokenizer, cached, args.personas)
+
+    print(f"without cache: {without_cache / args.personas * 1e3:.1f} ms per persona")
+    print(f"with cache:    {with_cache / args.personas * 1e3:.1f} ms per persona")
+    print(cached.kv_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
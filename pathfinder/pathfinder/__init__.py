@@ -1,8 +1,30 @@
+import importlib
+
 from ._gen import gen
 from ._select import select
 from ._find import find
 from .api import ModelAPI
 from .chat import *
-from .loader import get_model
-from .model import Model as PathFinderModel
 from .roles import assistant, system, user
+
+# names importing torch/transformers, imported on first use so that API-only runs
+# and tools start fast
+_LAZY = {
+    "Model": (".model", "Model"),
+    "PathFinderModel": (".model", "Model"),
+    "get_model": (".loader", "get_model"),
+    "loaded_models": (".loader", "loaded_models"),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _LAZY[name]
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY])
@@ -8,6 +8,7 @@ class Find:
         repetition_penalty,
         regex,
         stop_regex,
+        constrained=False,
     ) -> None:
         self.name = name
         self.max_tokens = max_tokens
@@ -16,11 +17,13 @@ class Find:
         self.repetition_penalty = repetition_penalty
         self.regex = regex
         self.stop_regex = stop_regex
+        self.constrained = constrained
 
     def __repr__(self) -> str:
         return (
             f"gen({self.name}, {self.max_tokens}, {self.temperature}, {self.top_p},"
-            f" {self.repetition_penalty}, {self.regex}, {self.stop_regex})"
+            f" {self.repetition_penalty}, {self.regex}, {self.stop_regex},"
+            f" {self.constrained})"
         )
 
     def __str__(self) -> str:
@@ -35,7 +38,23 @@ def find(
     repetition_penalty=1.0,
     regex=r".*",
     stop_regex=None,
+    constrained=False,
 ):
+    """
+    Generate, then extract the first match of `regex`.
+
+    With `constrained`, the generation is constrained to a match of `regex` (after
+    a little whitespace), and ends as soon as the match is complete. Supported by
+    the transformers and vLLM backends; regexes without a finite-state equivalent
+    (e.g. backreferences) are generated unconstrained.
+    """
     return Find(
-        name, max_tokens, temperature, top_p, repetition_penalty, regex, stop_regex
+        name,
+        max_tokens,
+        temperature,
+        top_p,
+        repetition_penalty,
+        regex,
+        stop_regex,
+        constrained,
     )
@@ -17,6 +17,14 @@ class Gen:
         self.stop_regex = stop_regex
         self.save_stop_text = save_stop_text
 
+    def stop_pattern(self):
+        """`stop_regex` as a single regex, None if the generation has no stop."""
+        if not self.stop_regex:
+            return None
+        if isinstance(self.stop_regex, str):
+            return self.stop_regex
+        return "|".join(self.stop_regex)
+
     def __repr__(self) -> str:
         return (
             f"gen({self.name}, {self.max_tokens}, {self.temperature}, {self.top_p},"
@@ -1,14 +1,19 @@
+SCORING_MODES = ("greedy", "loglik")
+
+
 class Select:
     def __init__(
         self,
         options,
         name,
+        scoring="greedy",
     ):
         self.options = options
         self.name = name
+        self.scoring = scoring
 
     def __repr__(self) -> str:
-        return f"select({self.options}, {self.name})"
+        return f"select({self.options}, {self.name}, {self.scoring})"
 
     def __str__(self) -> str:
         return self.__repr__()
@@ -17,8 +22,21 @@ class Select:
 def select(
     options=None,
     name="select",
+    scoring="greedy",
 ):
+    """
+    Choose one of `options`.
+
+    scoring:
+    - greedy: walk down the options token by token, taking the most likely one
+    - loglik: score the full log-likelihood of every option and take the highest.
+      The log-probs are also stored, as a dict option -> log-prob, in the
+      `f"{name}_logprobs"` variable. Only the transformers backend supports it.
+    """
+    if scoring not in SCORING_MODES:
+        raise ValueError(f"Unknown select scoring: {scoring}")
     return Select(
         options,
         name,
+        scoring,
     )
@@ -1,17 +1,20 @@
+import asyncio
 import copy
 import logging
+import os
+import random
+import threading
+import time
+import weakref
 from time import sleep
 from typing import Any
 
-import backoff
 import regex
 
 from ._find import Find
 from ._gen import Gen
 from ._select import Select
 from .backend import PathFinder
-from .model import Model
-from .trie import MarisaTrie, Trie
 
 
 def can_be_int(s):
@@ -22,12 +25,268 @@ def can_be_int(s):
         return False  # Return False if a ValueError is raised
 
 
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def shared_client(key, factory):
+    """
+    Process-wide client for `key`, built once with `factory`.
+
+    Clients keep a pool of HTTP connections, so every model of a provider reuses
+    the same sockets instead of opening its own.
+    """
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = factory()
+        return _shared_clients[key]
+
+
+def loop_client(key, factory):
+    """
+    Like `shared_client` for async clients, which are bound to the running event
+    loop: one client per loop and key.
+    """
+    loop = asyncio.get_running_loop()
+    with _shared_clients_lock:
+        clients = _loop_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+
+class ConcurrencyLimit:
+    """
+    Adaptive bound on the in-flight requests to a provider/model, shared by all
+    threads and event loops.
+
+    The limit is halved when the provider answers 429 (and everybody waits for its
+    Retry-After), and grows back by one after `limit` successful requests in a row,
+    up to `max_concurrency`.
+    """
+
+    _limits = {}
+    _limits_lock = threading.Lock()
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._successes = 0
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    @classmethod
+    def get(cls, key, max_concurrency: int) -> "ConcurrencyLimit":
+        with cls._limits_lock:
+            if key not in cls._limits:
+                cls._limits[key] = cls(max_concurrency)
+            return cls._limits[key]
+
+    def _try_acquire(self):
+        """
+        Returns None if a slot was taken, otherwise how long to wait before trying
+        again (0 for until a slot is released).
+        """
+        blocked_for = self.blocked_until - time.monotonic()
+        if blocked_for > 0:
+            return blocked_for
+        if self.in_flight < self.limit:
+            self.in_flight += 1
+            return None
+        return 0
+
+    def acquire(self):
+        with self._condition:
+            while (wait := self._try_acquire()) is not None:
+                self._condition.wait(timeout=wait or None)
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                wait = self._try_acquire()
+                if wait is None:
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, timeout=wait or None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self):
+        self._condition.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_future, waiter)
+            except RuntimeError:
+                pass  # the loop is closed
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._notify()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self.limit < self.max_concurrency and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._notify()
+
+    def on_rate_limited(self, retry_after: float):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+def _set_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket:
+    """
+    Budget of `per_minute` units refilled continuously. `reserve` takes units
+    right away, possibly going into debt, and returns how long the caller has to
+    wait for the debt to be paid back.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self, amount: float) -> float:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min budgets of a provider/model, used to pace requests
+    before sending them instead of reacting to 429s. Tokens are estimated before
+    the request and corrected with the reported usage afterwards.
+    """
+
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None) -> None:
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, key, requests_per_minute, tokens_per_minute) -> "RateLimiter":
+        with cls._limiters_lock:
+            if key not in cls._limiters:
+                cls._limiters[key] = cls(requests_per_minute, tokens_per_minute)
+            return cls._limiters[key]
+
+    def reserve(self, num_tokens: int) -> float:
+        """Returns the seconds to wait before sending the request."""
+        wait = 0.0
+        with self._lock:
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(num_tokens))
+        return wait
+
+    def record_usage(self, estimated_tokens: int, used_tokens):
+        if self.tokens is None or used_tokens is None:
+            return
+        with self._lock:
+            self.tokens.adjust(estimated_tokens - used_tokens)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# 429 (rate limit) and 529 (overloaded) shrink the concurrency, the others are
+# only retried
+RATE_LIMIT_STATUS = {429, 529}
+RETRY_STATUS = {408, 409, 500, 502, 503, 504, *RATE_LIMIT_STATUS}
+
+
+def _status_code(e):
+    status = getattr(e, "status_code", None) or getattr(e, "http_status", None)
+    if status is None and getattr(e, "response", None) is not None:
+        status = getattr(e.response, "status_code", None)
+    return status
+
+
+def _retry_after(e):
+    """Seconds from the Retry-After headers of the error response, if any."""
+    headers = getattr(e, "headers", None)
+    if headers is None and getattr(e, "response", None) is not None:
+        headers = getattr(e.response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass  # HTTP date, fall back to exponential backoff
+    return None
+
+
 class ModelAPI(PathFinder):
     token_in = 0
     token_out = 0
-
-    def __init__(self, model_name, seed, api_assistant=True) -> None:
+    # name of the provider, shared clients and concurrency limits are keyed on it
+    provider = None
+    max_concurrency = 8
+    # requests/min and tokens/min budgets, None for no pacing
+    requests_per_minute = None
+    tokens_per_minute = None
+    max_retries = 8
+    max_backoff = 60
+
+    def __init__(
+        self,
+        model_name,
+        seed,
+        api_assistant=True,
+        max_concurrency=None,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+    ) -> None:
         super().__init__(model_name)
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        # e.g. OPENAI_REQUESTS_PER_MINUTE, GROK_TOKENS_PER_MINUTE
+        env_prefix = (self.provider or type(self).__name__).upper()
+        self.requests_per_minute = requests_per_minute or _env_float(
+            f"{env_prefix}_REQUESTS_PER_MINUTE", self.requests_per_minute
+        )
+        self.tokens_per_minute = tokens_per_minute or _env_float(
+            f"{env_prefix}_TOKENS_PER_MINUTE", self.tokens_per_minute
+        )
 
         self.temperature = 0.0
         self.top_p = 1.0
@@ -61,10 +320,11 @@ class ModelAPI(PathFinder):
         self.temperature = value.temperature
         self.top_p = value.top_p
         self.max_tokens = value.max_tokens
-        if value.stop_regex is None:
+        stop_pattern = value.stop_pattern()
+        if stop_pattern is None:
             r = r"(.*?)"
         else:
-            r = rf"(.*?)({value.stop_regex})"
+            r = rf"(.*?)({stop_pattern})"
 
         return self.run(self, r, value.name, True, value.save_stop_text)
 
@@ -74,6 +334,11 @@ class ModelAPI(PathFinder):
         return self.run_find(self, value.regex, value.name)
 
     def _get_select(self, value: Select):
+        if value.scoring == "loglik":
+            raise NotImplementedError(
+                "Log-likelihood select scoring is only supported by the transformers"
+                " backend"
+            )
         if all(can_be_int(x) for x in value.options):
             r = r"(\d+)"
         else:
@@ -82,9 +347,103 @@ class ModelAPI(PathFinder):
             r += r")"
         return self.run(self, r, value.name, False, False)
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
+    def _limit(self) -> ConcurrencyLimit:
+        return ConcurrencyLimit.get(
+            (self.provider or type(self).__name__, self.model_name),
+            self.max_concurrency,
+        )
+
+    def _rate_limiter(self) -> RateLimiter:
+        return RateLimiter.get(
+            (self.provider or type(self).__name__, self.model_name),
+            self.requests_per_minute,
+            self.tokens_per_minute,
+        )
+
+    def _estimate_tokens(self, chat, max_tokens):
+        # providers count the prompt and max_tokens, ~4 characters per token
+        return sum(len(entry["content"]) for entry in chat) // 4 + max_tokens
+
+    def _retry_delay(self, e, attempt):
+        """
+        Seconds to wait before retrying after `e`, or None if the error is not
+        transient or the retries are exhausted.
+        """
+        if attempt >= self.max_retries:
+            return None
+        status = _status_code(e)
+        if status not in RETRY_STATUS and not self._is_connection_error(e):
+            return None
+        delay = _retry_after(e)
+        if delay is None:
+            delay = min(self.max_backoff, 2**attempt) * random.uniform(0.5, 1.0)
+        if status in RATE_LIMIT_STATUS:
+            self._limit().on_rate_limited(delay)
+        return delay
+
+    def _is_connection_error(self, e):
+        return False
+
+    def request_api(self, chat, temperature, top_p, max_tokens):
+        limit = self._limit()
+        rate_limiter = self._rate_limiter()
+        num_tokens = self._estimate_tokens(chat, max_tokens)
+        attempt = 0
+        while True:
+            sleep(rate_limiter.reserve(num_tokens))
+            limit.acquire()
+            try:
+                text, used_tokens = self._request(chat, temperature, top_p, max_tokens)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                logging.warning(f"{self.model_name}: {e}, retrying in {delay:.1f}s")
+            else:
+                limit.on_success()
+                rate_limiter.record_usage(num_tokens, used_tokens)
+                return text
+            finally:
+                limit.release()
+            sleep(delay)
+            attempt += 1
+
+    async def arequest_api(self, chat, temperature, top_p, max_tokens):
+        limit = self._limit()
+        rate_limiter = self._rate_limiter()
+        num_tokens = self._estimate_tokens(chat, max_tokens)
+        attempt = 0
+        while True:
+            await asyncio.sleep(rate_limiter.reserve(num_tokens))
+            await limit.aacquire()
+            try:
+                text, used_tokens = await self._arequest(
+                    chat, temperature, top_p, max_tokens
+                )
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                logging.warning(f"{self.model_name}: {e}, retrying in {delay:.1f}s")
+            else:
+                limit.on_success()
+                rate_limiter.record_usage(num_tokens, used_tokens)
+                return text
+            finally:
+                limit.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _request(self, chat, temperature, top_p, max_tokens):
+        """Returns the completion text and the tokens used (None if unknown)."""
         raise NotImplementedError
 
+    async def _arequest(self, chat, temperature, top_p, max_tokens):
+        # providers without an async client run the blocking request in a thread
+        return await asyncio.to_thread(
+            self._request, chat, temperature, top_p, max_tokens
+        )
+
     def run_find(self, lm, r, name):
         if lm.text_to_consume == "":
             tmp_chat = (
@@ -177,61 +536,85 @@ class ModelAPI(PathFinder):
         return res
 
 
-class OpenAIAPI(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed)
+class OpenAICompatibleAPI(ModelAPI):
+    """
+    Base of the providers served through the OpenAI client, subclasses set the
+    endpoint and the environment variable holding the API key.
+    """
+
+    provider = "openai"
+    base_url = None
+    api_key_env = None
+
+    def __init__(self, model_name, seed, **kwargs):
+        super().__init__(model_name, seed, **kwargs)
+        self.client = shared_client(self._client_key(), self._make_client)
+
+    def _client_kwargs(self) -> dict:
+        kwargs = {}
+        if self.base_url is not None:
+            kwargs["base_url"] = self.base_url
+        if self.api_key_env is not None:
+            kwargs["api_key"] = os.getenv(self.api_key_env)
+        return kwargs
+
+    def _client_key(self):
+        return (self.provider, *sorted(self._client_kwargs().items()))
+
+    def _make_client(self):
         from openai import OpenAI
 
-        self.client = OpenAI()
+        # retries are handled by ModelAPI, which also adapts the concurrency
+        return OpenAI(max_retries=0, **self._client_kwargs())
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        import openai
+    def _make_async_client(self):
+        from openai import AsyncOpenAI
 
-        @backoff.on_exception(backoff.expo, openai.RateLimitError)
-        def completions_with_backoff(**kwargs):
-            return self.client.chat.completions.create(**kwargs)
+        return AsyncOpenAI(max_retries=0, **self._client_kwargs())
 
-        out = completions_with_backoff(
+    def _completion_kwargs(self, chat, temperature, top_p, max_tokens) -> dict:
+        return dict(
             model=self.model_name,
             messages=chat,
-            temperature=tmeperature,
+            temperature=temperature,
             top_p=top_p,
             seed=self.seed,
             max_tokens=max_tokens,
         )
-        logging.info(f"OpenAI system_fingerprint: {out.system_fingerprint}")
-        return out.choices[0].message.content
 
+    def _is_connection_error(self, e):
+        import openai
 
-class OpenRouter(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed)
-        from os import getenv
+        return isinstance(e, openai.APIConnectionError)
 
-        from openai import OpenAI
+    def _process_completion(self, out):
+        logging.info(f"OpenAI system_fingerprint: {out.system_fingerprint}")
+        return out.choices[0].message.content
 
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=getenv("OPENROUTER_API_KEY"),
+    def _request(self, chat, temperature, top_p, max_tokens):
+        out = self.client.chat.completions.create(
+            **self._completion_kwargs(chat, temperature, top_p, max_tokens)
         )
+        used_tokens = out.usage.total_tokens if out.usage is not None else None
+        return self._process_completion(out), used_tokens
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        import openai
+    async def _arequest(self, chat, temperature, top_p, max_tokens):
+        client = loop_client(self._client_key(), self._make_async_client)
+        out = await client.chat.completions.create(
+            **self._completion_kwargs(chat, temperature, top_p, max_tokens)
+        )
+        used_tokens = out.usage.total_tokens if out.usage is not None else None
+        return self._process_completion(out), used_tokens
 
-        @backoff.on_exception(backoff.expo, openai.RateLimitError)
-        def completions_with_backoff(**kwargs):
-            return self.client.chat.completions.create(**kwargs)
 
-        out = completions_with_backoff(
-            model=self.model_name,
-            messages=chat,
-            temperature=tmeperature,
-            top_p=top_p,
-            seed=self.seed,
-            max_tokens=max_tokens,
-        )
-        logging.info(f"OpenAI system_fingerprint: {out.system_fingerprint}")
-        return out.choices[0].message.content
+class OpenAIAPI(OpenAICompatibleAPI):
+    pass
+
+
+class OpenRouter(OpenAICompatibleAPI):
+    provider = "openrouter"
+    base_url = "https://openrouter.ai/api/v1"
+    api_key_env = "OPENROUTER_API_KEY"
 
 
 import json
@@ -285,29 +668,24 @@ def append_token_usage(token_in, token_out, model, file_name):
 import uuid
 
 
-class AzureOpenAIAPI(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed)
-        from openai import AzureOpenAI
+class AzureOpenAIAPI(OpenAICompatibleAPI):
+    provider = "azure"
 
-        self.client = AzureOpenAI()
+    def __init__(self, model_name, seed, **kwargs):
+        super().__init__(model_name, seed, **kwargs)
         self.random_name = str(uuid.uuid4())
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        import openai
+    def _make_client(self):
+        from openai import AzureOpenAI
 
-        @backoff.on_exception(backoff.expo, openai.RateLimitError)
-        def completions_with_backoff(**kwargs):
-            return self.client.chat.completions.create(**kwargs)
+        return AzureOpenAI(max_retries=0)
 
-        out = completions_with_backoff(
-            model=self.model_name,
-            messages=chat,
-            temperature=tmeperature,
-            top_p=top_p,
-            seed=self.seed,
-            max_tokens=max_tokens,
-        )
+    def _make_async_client(self):
+        from openai import AsyncAzureOpenAI
+
+        return AsyncAzureOpenAI(max_retries=0)
+
+    def _process_completion(self, out):
         logging.info(f"OpenAI system_fingerprint: {out.system_fingerprint}")
 
         self.token_in = out.usage.prompt_tokens
@@ -323,51 +701,59 @@ class AzureOpenAIAPI(ModelAPI):
 import os
 
 
-class MistralAPI(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed, api_assistant=False)
-        from httpx import Client as HTTPClient
-        from httpx import HTTPTransport
-        from mistralai.client import MistralClient
+def _mistral_http_client(timeout, max_retries):
+    from httpx import Client as HTTPClient
+    from httpx import HTTPTransport
+
+    http_proxies = [
+        proxy
+        for varname, proxy in os.environ.items()
+        if varname.lower() == "http_proxy"
+    ]
+    https_proxies = [
+        proxy
+        for varname, proxy in os.environ.items()
+        if varname.lower() == "https_proxy"
+    ]
+    all_proxies = [
+        proxy for varname, proxy in os.environ.items() if varname.lower() == "all_proxy"
+    ]
+    proxies = {
+        "http://": http_proxies[0] if len(http_proxies) > 0 else None,
+        "https://": https_proxies[0] if len(https_proxies) > 0 else None,
+        "all://": all_proxies[0] if len(all_proxies) > 0 else None,
+    }
+
+    return HTTPClient(
+        proxies=proxies,
+        follow_redirects=True,
+        timeout=timeout,
+        transport=HTTPTransport(retries=max_retries),
+    )
 
-        api_key = os.environ["MISTRAL_API_KEY"]
-        self.client = MistralClient(api_key=api_key)
 
-        http_proxies = [
-            proxy
-            for varname, proxy in os.environ.items()
-            if varname.lower() == "http_proxy"
-        ]
-        https_proxies = [
-            proxy
-            for varname, proxy in os.environ.items()
-            if varname.lower() == "https_proxy"
-        ]
-        all_proxies = [
-            proxy
-            for varname, proxy in os.environ.items()
-            if varname.lower() == "all_proxy"
-        ]
-        proxies = {
-            "http://": http_proxies[0] if len(http_proxies) > 0 else None,
-            "https://": https_proxies[0] if len(https_proxies) > 0 else None,
-            "all://": all_proxies[0] if len(all_proxies) > 0 else None,
-        }
-
-        self.client._client = HTTPClient(
-            proxies=proxies,
-            follow_redirects=True,
-            timeout=self.client._timeout,
-            transport=HTTPTransport(retries=self.client._max_retries),
+class MistralAPI(ModelAPI):
+    provider = "mistral"
+
+    def __init__(self, model_name, seed, **kwargs):
+        super().__init__(model_name, seed, api_assistant=False, **kwargs)
+        self.client = shared_client(
+            (self.provider, os.environ["MISTRAL_API_KEY"]), self._make_client
         )
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        from mistralai.exceptions import MistralException
+    def _make_client(self):
+        from mistralai.client import MistralClient
+
+        client = MistralClient(api_key=os.environ["MISTRAL_API_KEY"])
+        client._client = _mistral_http_client(client._timeout, client._max_retries)
+        return client
 
-        @backoff.on_exception(backoff.expo, MistralException)
-        def completions_with_backoff(**kwargs):
-            return self.client.chat(**kwargs)
+    def _is_connection_error(self, e):
+        from mistralai.exceptions import MistralConnectionException
 
+        return isinstance(e, MistralConnectionException)
+
+    def _request(self, chat, temperature, top_p, max_tokens):
         from mistralai.models.chat_completion import ChatMessage
 
         if chat[-1]["role"] == "assistant":
@@ -378,72 +764,74 @@ class MistralAPI(ModelAPI):
         chat_mistral = [
             ChatMessage(role=entry["role"], content=entry["content"]) for entry in chat
         ]
-        out = completions_with_backoff(
+        out = self.client.chat(
             model=self.model_name,
             messages=chat_mistral,
-            temperature=tmeperature,
+            temperature=temperature,
             top_p=top_p,
             random_seed=self.seed,
             max_tokens=max_tokens,
         )
-        return out.choices[0].message.content
+        used_tokens = out.usage.total_tokens if out.usage is not None else None
+        return out.choices[0].message.content, used_tokens
 
 
 class AnthropicAPI(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed, api_assistant=False)
+    provider = "anthropic"
+
+    def __init__(self, model_name, seed, **kwargs):
+        super().__init__(model_name, seed, api_assistant=False, **kwargs)
+        self.client = shared_client((self.provider,), self._make_client)
+
+    def _make_client(self):
         from anthropic import Anthropic
 
-        self.client = Anthropic()
+        # retries are handled by ModelAPI, which also adapts the concurrency
+        return Anthropic(max_retries=0)
+
+    def _make_async_client(self):
+        from anthropic import AsyncAnthropic
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        from anthropic._exceptions import APIStatusError
+        return AsyncAnthropic(max_retries=0)
 
-        @backoff.on_exception(backoff.expo, APIStatusError)
-        def completions_with_backoff(**kwargs):
-            return self.client.messages.create(**kwargs)
+    def _is_connection_error(self, e):
+        import anthropic
 
+        return isinstance(e, anthropic.APIConnectionError)
+
+    def _message_kwargs(self, chat, temperature, top_p, max_tokens) -> dict:
         if chat[-1]["role"] == "assistant":
             raise Exception(
                 "Assistant should not be the last role in the chat for Anthropic."
             )
 
-        out = completions_with_backoff(
+        return dict(
             model=self.model_name,
             messages=chat,
-            temperature=tmeperature,
+            temperature=temperature,
             top_p=top_p,
             max_tokens=max_tokens,
         )
-        return out.content[0].text
-
 
-class GrokAPI(ModelAPI):
-    def __init__(self, model_name, seed):
-        super().__init__(model_name, seed)
-        from os import getenv
-
-        from openai import OpenAI
+    def _request(self, chat, temperature, top_p, max_tokens):
+        out = self.client.messages.create(
+            **self._message_kwargs(chat, temperature, top_p, max_tokens)
+        )
+        return out.content[0].text, out.usage.input_tokens + out.usage.output_tokens
 
-        self.client = OpenAI(
-            base_url="https://api.x.ai/v1",
-            api_key=getenv("XAI_API_KEY"),
+    async def _arequest(self, chat, temperature, top_p, max_tokens):
+        client = loop_client((self.provider,), self._make_async_client)
+        out = await client.messages.create(
+            **self._message_kwargs(chat, temperature, top_p, max_tokens)
         )
+        return out.content[0].text, out.usage.input_tokens + out.usage.output_tokens
 
-    def request_api(self, chat, tmeperature, top_p, max_tokens):
-        import openai
 
-        @backoff.on_exception(backoff.expo, openai.RateLimitError)
-        def completions_with_backoff(**kwargs):
-            return self.client.chat.completions.create(**kwargs)
+class GrokAPI(OpenAICompatibleAPI):
+    provider = "grok"
+    base_url = "https://api.x.ai/v1"
+    api_key_env = "XAI_API_KEY"
 
-        out = completions_with_backoff(
-            model=self.model_name,
-            messages=chat,
-            temperature=tmeperature,
-            top_p=top_p,
-            seed=self.seed,
-            max_tokens=max_tokens,
-        )
+    def _process_completion(self, out):
         logging.info(f"Grok system_fingerprint: {out.system_fingerprint}")
         return out.choices[0].message.content
@@ -1,3 +1,4 @@
+import contextvars
 import copy
 
 from ._find import Find
@@ -5,21 +6,124 @@ from ._gen import Gen
 from ._select import Select
 
 
-class PathFinder:
-    open_block = None
-    empty_block = True
+# role-block state of the current thread or asyncio task
+_open_block = contextvars.ContextVar("open_block", default=None)
+_empty_block = contextvars.ContextVar("empty_block", default=True)
 
+
+class _PathFinderMeta(type):
+    """
+    Keeps the role-block state (PathFinder.open_block/empty_block) in context
+    variables, so prompts can be built from several threads or asyncio tasks at
+    once: each thread starts without an open block, and each task works on a copy
+    of the state of the code that created it.
+    """
+
+    @property
+    def open_block(cls):
+        return _open_block.get()
+
+    @open_block.setter
+    def open_block(cls, value):
+        _open_block.set(value)
+
+    @property
+    def empty_block(cls):
+        return _empty_block.get()
+
+    @empty_block.setter
+    def empty_block(cls, value):
+        _empty_block.set(value)
+
+
+class _Text:
+    """
+    Immutable text built by appending segments: appending is O(1) and shares the
+    text before it. The segments are joined on the first read, and the result is
+    kept, so a later read only joins the segments appended since.
+    """
+
+    __slots__ = ("_state", "length")
+
+    def __init__(self, parent=None, segment="") -> None:
+        self._state = (parent, segment)  # replaced as a whole, for readers
+        self.length = len(segment) + (0 if parent is None else parent.length)
+
+    def __add__(self, segment: str):
+        return _Text(self, segment) if segment else self
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        parent, segment = self._state
+        if parent is None:
+            return segment
+        segments = [segment]
+        while parent is not None:
+            parent, segment = parent._state
+            segments.append(segment)
+        text = "".join(reversed(segments))
+        self._state = (None, text)
+        return text
+
+
+class PathFinder(metaclass=_PathFinderMeta):
     token_in = 0
     token_out = 0
 
     def __init__(self, model_name) -> None:
         self.model_name = model_name
         self._variables = {}
-        self.chat = []
+        # (role, _Text) messages shared between copies, or a _Text outside of
+        # chat blocks; `chat` is built from it when read
+        self._chat = ()
+        self._chat_view = None
 
         self.prefix_text = ""
         self.text_to_consume = ""
 
+    @property
+    def chat(self):
+        """
+        The chat as a list of {"role", "content"} messages, or a string outside of
+        chat blocks. It is built on first read and must not be modified in place:
+        assign `chat` to replace it.
+        """
+        chat = self._chat_view
+        if chat is None:
+            if isinstance(self._chat, _Text):
+                chat = str(self._chat)
+            else:
+                chat = [
+                    {"role": role, "content": str(content)}
+                    for role, content in self._chat
+                ]
+            self._chat_view = chat
+        return chat
+
+    @chat.setter
+    def chat(self, chat):
+        if isinstance(chat, str):
+            self._chat = _Text(None, chat)
+        else:
+            self._chat = tuple(
+                (entry["role"], _Text(None, entry["content"])) for entry in chat
+            )
+        self._chat_view = None
+
+    def _append_text(self, text):
+        """Appends to the last message (or the prompt outside of chat blocks)."""
+        if isinstance(self._chat, _Text):
+            self._chat = self._chat + text
+        else:
+            role, content = self._chat[-1]
+            self._chat = self._chat[:-1] + ((role, content + text),)
+        self._chat_view = None
+
+    def _last_role(self):
+        return None if isinstance(self._chat, _Text) else self._chat[-1][0]
+
     def _current_prompt(self):
         raise NotImplementedError
 
@@ -43,13 +147,9 @@ class PathFinder:
     def copy(self):
         """Create a shallow copy of the model object."""
 
-        # start with a shallow copy
+        # start with a shallow copy, the chat is immutable and shared
         new_lm = copy.copy(self)
         new_lm._variables = self._variables.copy()
-        if isinstance(self.chat, list):
-            new_lm.chat = self.chat.copy()
-        else:
-            new_lm.chat = self.chat
 
         return new_lm
 
@@ -60,7 +160,7 @@ class PathFinder:
         lm = self.copy()
 
         if (
-            len(lm.chat) == 0
+            len(lm._chat) == 0
             and PathFinder.empty_block
             and PathFinder.open_block is None
         ):
@@ -68,30 +168,23 @@ class PathFinder:
             lm.chat = ""
         elif PathFinder.open_block is not None and PathFinder.open_block.init_tag:
             PathFinder.open_block.init_tag = False
-            lm.chat.append(
-                {
-                    "role": PathFinder.open_block.role,
-                    "content": "",
-                }
-            )
+            lm._chat = lm._chat + ((PathFinder.open_block.role, _Text()),)
+            lm._chat_view = None
             if PathFinder.open_block.role == "assistant":
                 lm.prefix_text = ""
 
         if isinstance(value, str):
-            if isinstance(lm.chat, list):
-                lm.chat[-1]["content"] += value
-            else:
-                lm.chat += value
+            lm._append_text(value)
 
-            if lm.chat[-1]["role"] == "assistant":
+            if lm._last_role() == "assistant":
                 lm._consume_assistant_text(value)
         else:
-            if isinstance(lm.chat, list):
-                if lm.chat[-1]["role"] != "assistant":
-                    raise Exception(
-                        f"{value} can be used only in assistant block, not in"
-                        f" {lm.chat[-1]['role']} block!"
-                    )
+            role = lm._last_role()
+            if role is not None and role != "assistant":
+                raise Exception(
+                    f"{value} can be used only in assistant block, not in"
+                    f" {role} block!"
+                )
             if isinstance(value, Gen):
                 res = lm._get_gen(value)
                 original_res = res
@@ -103,10 +196,7 @@ class PathFinder:
             else:
                 raise Exception(f"Unknown type {type(value)}")
 
-            if isinstance(lm.chat, list):
-                lm.chat[-1]["content"] += original_res
-            else:
-                lm.chat += original_res
+            lm._append_text(original_res)
             lm._variables[value.name] = res
 
         return lm
@@ -1,9 +1,5 @@
 import os
 
-from transformers import PreTrainedModel, PreTrainedTokenizer
-
-from .model import Model
-
 
 class LlamaChat:
     def __init__(self):
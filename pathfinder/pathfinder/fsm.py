@@ -0,0 +1,315 @@
+"""
+Finite-state machines of regexes, used to constrain decoding so that the generated
+text is always the prefix of a match.
+
+The machines may accept more than the regex (anchors, word boundaries and
+lookarounds are ignored), so the generated text is still checked with the regex.
+"""
+
+import functools
+import threading
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_constants
+    import sre_parse
+
+# counted repeats are unrolled, bigger ones are not supported
+MAX_UNROLLED_REPEAT = 1000
+
+
+def constrained_find_pattern(pattern: str) -> str:
+    """
+    Regex a constrained find generates: a match, after a little whitespace (e.g.
+    the space of the " 5" token). The whitespace is bounded, otherwise a model
+    could keep generating it.
+    """
+    return rf"\s{{0,4}}(?:{pattern})"
+
+
+class UnsupportedRegex(ValueError):
+    """The regex has no finite-state equivalent, e.g. it has backreferences."""
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: str.isdecimal,
+    sre_constants.CATEGORY_NOT_DIGIT: lambda char: not char.isdecimal(),
+    sre_constants.CATEGORY_SPACE: str.isspace,
+    sre_constants.CATEGORY_NOT_SPACE: lambda char: not char.isspace(),
+    sre_constants.CATEGORY_WORD: _is_word,
+    sre_constants.CATEGORY_NOT_WORD: lambda char: not _is_word(char),
+}
+
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_constants, name)
+)
+_IGNORED = tuple(
+    getattr(sre_constants, name)
+    for name in ("AT", "ASSERT", "ASSERT_NOT")
+    if hasattr(sre_constants, name)
+)
+
+
+def _set_predicate(items):
+    negate = False
+    chars = set()
+    ranges = []
+    categories = []
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_constants.RANGE:
+            ranges.append((chr(av[0]), chr(av[1])))
+        elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+            categories.append(_CATEGORIES[av])
+        else:
+            raise UnsupportedRegex(f"Unsupported character set item {op}")
+
+    def predicate(char):
+        matched = (
+            char in chars
+            or any(low <= char <= high for low, high in ranges)
+            or any(category(char) for category in categories)
+        )
+        return matched != negate
+
+    return predicate
+
+
+class _NFA:
+    """Thompson NFA over characters, built from the parse tree of a regex."""
+
+    def __init__(self, dotall):
+        self.dotall = dotall
+        self.epsilon = []  # state -> states reached without reading a character
+        self.edges = []  # state -> [(predicate, state)]
+
+    def new_state(self):
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def build(self, items, start):
+        """Adds the states matching `items` after `start`, returns the end state."""
+        state = start
+        for op, av in items:
+            state = self._build_item(op, av, state)
+        return state
+
+    def _build_item(self, op, av, start):
+        if op is sre_constants.LITERAL:
+            char = chr(av)
+            return self._edge(start, lambda c: c == char)
+        if op is sre_constants.NOT_LITERAL:
+            char = chr(av)
+            return self._edge(start, lambda c: c != char)
+        if op is sre_constants.ANY:
+            if self.dotall:
+                return self._edge(start, lambda c: True)
+            return self._edge(start, lambda c: c != "\n")
+        if op is sre_constants.IN:
+            return self._edge(start, _set_predicate(av))
+        if op is sre_constants.BRANCH:
+            end = self.new_state()
+            for items in av[1]:
+                branch = self.new_state()
+                self.epsilon[start].append(branch)
+                self.epsilon[self.build(items, branch)].append(end)
+            return end
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, _, items = av
+            if add_flags & sre_constants.SRE_FLAG_IGNORECASE:
+                raise UnsupportedRegex("Case-insensitive groups are not supported")
+            return self.build(items, start)
+        if hasattr(sre_constants, "ATOMIC_GROUP") and op is sre_constants.ATOMIC_GROUP:
+            return self.build(av, start)
+        if op in _REPEATS:
+            return self._build_repeat(*av, start)
+        if op in _IGNORED:
+            return start
+        raise UnsupportedRegex(f"Unsupported regex construct {op}")
+
+    def _edge(self, start, predicate):
+        end = self.new_state()
+        self.edges[start].append((predicate, end))
+        return end
+
+    def _build_repeat(self, min_count, max_count, items, start):
+        unbounded = max_count == sre_constants.MAXREPEAT
+        if max(min_count, 0 if unbounded else max_count) > MAX_UNROLLED_REPEAT:
+            raise UnsupportedRegex("Repeat count too large")
+        state = start
+        for _ in range(min_count):
+            state = self.build(items, state)
+        if unbounded:
+            loop = self.new_state()
+            self.epsilon[state].append(loop)
+            self.epsilon[self.build(items, loop)].append(loop)
+            return loop
+        end = self.new_state()
+        for _ in range(max_count - min_count):
+            self.epsilon[state].append(end)
+            state = self.build(items, state)
+        self.epsilon[state].append(end)
+        return end
+
+
+class RegexFSM:
+    """
+    DFA of a regex, with states as sets of NFA states built on demand. The text
+    read so far is the prefix of a match as long as the state is not empty.
+    """
+
+    def __init__(self, pattern: str) -> None:
+        try:
+            parsed = sre_parse.parse(pattern)
+        except Exception as e:  # regex-only syntax
+            raise UnsupportedRegex(str(e)) from e
+        flags = parsed.state.flags
+        if flags & sre_constants.SRE_FLAG_IGNORECASE:
+            raise UnsupportedRegex("Case-insensitive regexes are not supported")
+        self.nfa = _NFA(dotall=bool(flags & sre_constants.SRE_FLAG_DOTALL))
+        start = self.nfa.new_state()
+        self.final = self.nfa.build(parsed, start)
+        self.initial = self._closure({start})
+        self._transitions = {}
+
+    def _closure(self, states):
+        stack = list(states)
+        closure = set(states)
+        while stack:
+            for state in self.nfa.epsilon[stack.pop()]:
+                if state not in closure:
+                    closure.add(state)
+                    stack.append(state)
+        return frozenset(closure)
+
+    def step(self, state: frozenset, char: str) -> frozenset:
+        key = (state, char)
+        next_state = self._transitions.get(key)
+        if next_state is None:
+            next_state = self._closure(
+                {
+                    target
+                    for s in state
+                    for predicate, target in self.nfa.edges[s]
+                    if predicate(char)
+                }
+            )
+            self._transitions[key] = next_state
+        return next_state
+
+    def walk(self, state: frozenset, text: str) -> frozenset:
+        for char in text:
+            state = self.step(state, char)
+            if not state:
+                break
+        return state
+
+    def is_accepting(self, state: frozenset) -> bool:
+        return self.final in state
+
+
+def _expand(items, max_strings):
+    """The strings matched by `items`, None if they are not a few fixed strings."""
+    strings = [""]
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            options = [chr(av)]
+        elif op is sre_constants.IN and all(
+            item_op is sre_constants.LITERAL for item_op, _ in av
+        ):
+            options = [chr(item_av) for _, item_av in av]
+        elif op is sre_constants.BRANCH:
+            options = []
+            for branch in av[1]:
+                expanded = _expand(branch, max_strings)
+                if expanded is None:
+                    return None
+                options.extend(expanded)
+        elif op is sre_constants.SUBPATTERN and not av[1]:
+            options = _expand(av[3], max_strings)
+            if options is None:
+                return None
+        else:
+            return None
+        strings = [string + option for string in strings for option in options]
+        if len(strings) > max_strings:
+            return None
+    return strings
+
+
+def literal_alternatives(pattern: str, max_strings: int = 16):
+    """
+    The strings `pattern` matches if it is an alternation of at most `max_strings`
+    literals (e.g. `Answer:|So, the answer is:` or `\\.`), otherwise None.
+    The vLLM backend uses them as the native stop strings of a generation.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:  # regex-only syntax
+        return None
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return None
+    strings = _expand(parsed, max_strings)
+    if not strings or "" in strings:
+        return None
+    return list(dict.fromkeys(strings))
+
+
+@functools.lru_cache(maxsize=64)
+def compile_fsm(pattern: str) -> RegexFSM:
+    return RegexFSM(pattern)
+
+
+class TokenFSM:
+    """
+    Token-level view of a RegexFSM: the tokens that keep the generated text the
+    prefix of a match, computed once per state.
+
+    Args:
+        fsm: FSM of the regex
+        vocabulary: (token id, decoded text) of the tokens that can be generated
+    """
+
+    def __init__(self, fsm: RegexFSM, vocabulary: list[tuple[int, str]]) -> None:
+        self.fsm = fsm
+        self.texts = dict(vocabulary)
+        self.by_first_char = {}
+        for token, text in vocabulary:
+            self.by_first_char.setdefault(text[0], []).append((token, text[1:]))
+        self._allowed = {}
+        self.lock = threading.Lock()
+
+    def next_state(self, state: frozenset, token: int) -> frozenset:
+        text = self.texts.get(token)
+        if text is None:
+            return frozenset()
+        return self.fsm.walk(state, text)
+
+    def allowed_tokens(self, state: frozenset) -> list[int]:
+        allowed = self._allowed.get(state)
+        if allowed is None:
+            with self.lock:
+                allowed = []
+                for char, tokens in self.by_first_char.items():
+                    after_char = self.fsm.step(state, char)
+                    if not after_char:
+                        continue
+                    allowed.extend(
+                        token
+                        for token, rest in tokens
+                        if self.fsm.walk(after_char, rest)
+                    )
+                self._allowed[state] = allowed
+        return allowed
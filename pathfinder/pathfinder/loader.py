@@ -1,6 +1,5 @@
-import torch
-from accelerate import infer_auto_device_map
-from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+import threading
+import time
 
 from .api import AnthropicAPI, AzureOpenAIAPI, GrokAPI, MistralAPI, OpenAIAPI, OpenRouter
 from .chat import (
@@ -12,11 +11,9 @@ from .chat import (
     MetaMath,
     MistralInstruct,
     MixtralInstruct,
-    Model,
     Phi3,
     Vicuna,
 )
-from .model import Model
 
 
 def get_api_model(name, seed):
@@ -42,6 +39,8 @@ def get_gpu_memory_no_reserve(gpu_list):
     Detect the total memory on each GPU in the list without reserving extra overhead.
     Returns a dictionary mapping each GPU to its total memory.
     """
+    import torch
+
     max_memory = {}
     for gpu in gpu_list:
         total_memory = torch.cuda.get_device_properties(gpu).total_memory
@@ -53,25 +52,126 @@ def get_available_gpus():
     """
     Returns a list of all available GPUs in the format [0, 1, ...].
     """
+    import torch
+
     if not torch.cuda.is_available():
         return []  # No GPUs available
     return [i for i in range(torch.cuda.device_count())]
 
 
+def get_revision(name):
+    """Branch of the weights of `name`, and whether its context is extended."""
+    branch = "main"
+    extend_context_length = True
+    if "gptq" in name.lower():
+        branch = "gptq-4bit-32g-actorder_True"
+
+        if "metamath" in name.lower() and not "mistral" in name.lower():
+            branch = "gptq-4-32g-actorder_True"
+        elif "smaug" in name.lower():
+            branch = "main"
+        elif name.startswith("Qwen"):
+            branch = "main"
+            extend_context_length = False
+
+        if not "thebloke" in name.lower():
+            branch = "main"
+            extend_context_length = False
+    return branch, extend_context_length
+
+
+# (name, backend, revision) -> (model, memory/load time of the model)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _device_bytes_used():
+    import torch
+
+    if not torch.cuda.is_available():
+        return 0
+    used = 0
+    for device in range(torch.cuda.device_count()):
+        free, total = torch.cuda.mem_get_info(device)
+        used += total - free
+    return used
+
+
+def _module_bytes(module):
+    tensors = [*module.parameters(), *module.buffers()]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
 def get_model(
     name,
     is_api=False,
     seed=42,
     backend_name="transformers",
     gpu_list=None,
+    kv_cache_bytes=None,
 ):
-    if gpu_list is None:
-        gpu_list = get_available_gpus()
+    """
+    Model `name` served by `backend_name`, or by its API if `is_api`.
+
+    Local models are loaded once per process and (name, backend, revision): the
+    callers share the instance and pass their own sampling parameters with each
+    gen/find/select. `seed`, `gpu_list` and `kv_cache_bytes` only apply to the
+    first load.
+
+    `kv_cache_bytes` caps the prompt KV cache reused across the calls of a
+    transformers model (0 disables it). By default it is 1 GiB on CPU and off on
+    GPU, where the weights are given all the device memory.
+
+    The "remote" backend runs the model in a `pathfinder serve` daemon, which
+    keeps it loaded across processes.
+    """
     if is_api:
         return get_api_model(name, seed)
+    if backend_name == "remote":
+        from .remote import ModelRemote
+
+        return ModelRemote(name, seed)
+    key = (name, backend_name, get_revision(name)[0])
+    with _registry_lock:
+        if key not in _registry:
+            device_bytes = _device_bytes_used()
+            start = time.perf_counter()
+            model = _load_model(name, seed, backend_name, gpu_list, kv_cache_bytes)
+            info = {
+                "load_seconds": time.perf_counter() - start,
+                # the device memory taken by the load, vLLM reserves its KV cache
+                "device_bytes": _device_bytes_used() - device_bytes,
+            }
+            _registry[key] = (model, info)
+        return _registry[key][0]
+
+
+def loaded_models() -> list[dict]:
+    """Models loaded by `get_model`, with their load time and resident memory."""
+    with _registry_lock:
+        entries = list(_registry.items())
+    report = []
+    for (name, backend_name, revision), (model, info) in entries:
+        entry = {"name": name, "backend": backend_name, "revision": revision, **info}
+        session = getattr(model, "session", None)
+        if session is not None:  # transformers backend
+            entry["weights_bytes"] = _module_bytes(model.model)
+            if session.kv_cache is not None:
+                entry["kv_cache_bytes"] = session.kv_cache.stats()["num_bytes"]
+        report.append(entry)
+    return report
+
+
+def _load_model(name, seed, backend_name, gpu_list, kv_cache_bytes=None):
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+    from .model import GenerationSession, Model
+
+    if gpu_list is None:
+        gpu_list = get_available_gpus()
     trust_remote_code = False
     use_fast = True
-    extend_context_length = True
     if "metamath" in name.lower():
         cls = MetaMath
     elif "llama-3" in name.lower():
@@ -108,21 +208,7 @@ def get_model(
     else:
         raise ValueError(f"Unknown model name {name}")
 
-    branch = "main"
-    if "gptq" in name.lower():
-        branch = "gptq-4bit-32g-actorder_True"
-
-        if "metamath" in name.lower() and not "mistral" in name.lower():
-            branch = "gptq-4-32g-actorder_True"
-        elif "smaug" in name.lower():
-            branch = "main"
-        elif name.startswith("Qwen"):
-            branch = "main"
-            extend_context_length = False
-
-        if not "thebloke" in name.lower():
-            branch = "main"
-            extend_context_length = False
+    branch, extend_context_length = get_revision(name)
 
     tokenizer = AutoTokenizer.from_pretrained(
         name, use_fast=use_fast, trust_remote_code=trust_remote_code
@@ -153,13 +239,23 @@ def get_model(
             model = exllama_set_max_input_length(model, max_input_length=4096)
 
         model = torch.compile(model)
+        model.name_or_path = name
+        if kv_cache_bytes is None:
+            kv_cache_bytes = 0 if model.device.type == "cuda" else 1 << 30
         backend = Model(
             model=model,
             tokenizer=tokenizer,
             trust_remote_code=trust_remote_code,
             template=cls().template,
+            # configs and eos tokens resolved once for all the calls
+            session=GenerationSession(
+                model,
+                tokenizer,
+                trust_remote_code,
+                reuse_kv_cache=kv_cache_bytes > 0,
+                kv_cache_bytes=kv_cache_bytes,
+            ),
         )
-        model.name_or_path = name
         print("Model device")
         print(model.device)
 
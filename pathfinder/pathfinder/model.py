@@ -1,12 +1,15 @@
 import copy
+import functools
+import heapq
+import inspect
+import threading
 from typing import Any
 
 import numpy as np
-import pygtrie
 import regex
 import torch
 from transformers import (
-    AutoConfig,
+    DynamicCache,
     GenerationConfig,
     LogitsProcessor,
     LogitsProcessorList,
@@ -21,30 +24,160 @@ from transformers import (
 from ._find import Find
 from ._gen import Gen
 from ._select import Select
+from .fsm import TokenFSM, UnsupportedRegex, compile_fsm, constrained_find_pattern
 from .trie import MarisaTrie, Trie
 
+# prompt tokens tokenized again with each select option, see `_tokenize_options`
+SELECT_RETOKENIZED_TOKENS = 8
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_constants
+    import sre_parse
+
+
+def _max_match_length(pattern):
+    """Longest text `pattern` can match, None if unbounded or unknown."""
+    try:
+        _, max_width = sre_parse.parse(pattern).getwidth()
+    except Exception:
+        return None  # regex-only syntax
+    if max_width >= sre_constants.MAXREPEAT:
+        return None
+    return max_width
+
+
+@functools.lru_cache(maxsize=256)
+def compile_stop_regex(stop_pattern):
+    """
+    Compiled stop regexes of a pattern or tuple of patterns, and the length of the
+    longest text they can match (None if unbounded).
+    """
+    if isinstance(stop_pattern, str):
+        stop_pattern = (stop_pattern,)
+    stop_regex = [regex.compile(pattern) for pattern in stop_pattern]
+    lengths = [_max_match_length(pattern) for pattern in stop_pattern]
+    max_length = None if None in lengths else max(lengths, default=0)
+    return stop_regex, max_length
+
+
+class IncrementalDecoder:
+    """
+    Decodes a growing token sequence by only decoding the new tokens and a few
+    tokens before them (prefix/read offsets), so that tokenizers which merge
+    spaces or multi-byte characters across tokens decode as a whole sequence.
+    """
+
+    def __init__(self, decode):
+        self.decode = decode
+        self.tokens = []
+        # text of tokens[:read_offset]
+        self.text = ""
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def add(self, new_tokens):
+        """Add tokens, returns the decoded text including the unfinished tail."""
+        self.tokens.extend(new_tokens)
+        prefix_text = self.decode(
+            self.tokens[self.prefix_offset : self.read_offset],
+            skip_special_tokens=False,
+        )
+        new_text = self.decode(
+            self.tokens[self.prefix_offset :], skip_special_tokens=False
+        )
+        tail = new_text[len(prefix_text) :]
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            # the new tokens form complete characters
+            self.text += tail
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return self.text
+        return self.text + tail
+
 
 class RegexStoppingCriteria(StoppingCriteria):
+    """
+    Stops when any of the stop regexes is found in the generated text.
+
+    The text is decoded incrementally and only the part that can hold a new match
+    is searched: a match found at a previous step would have stopped generation,
+    so a new one must end in the text added since, and is at most as long as the
+    longest text the patterns can match. A match is confirmed on the full decoded
+    text before stopping, so the stopping step is the same as searching the whole
+    decoded text at every step.
+    """
+
     def __init__(self, stop_pattern, decode, prefix_length):
-        if isinstance(stop_pattern, str):
-            self.stop_regex = [regex.compile(stop_pattern)]
-        else:
-            self.stop_regex = [regex.compile(pattern) for pattern in stop_pattern]
+        if not isinstance(stop_pattern, str):
+            stop_pattern = tuple(stop_pattern)
+        self.stop_regex, self.max_length = compile_stop_regex(stop_pattern)
         self.prefix_length = prefix_length
         self.decode = decode
-        self.current_strings = None
-        self.current_length = 0
+        self.decoder = IncrementalDecoder(decode)
+        self.num_tokens = 0
+
+    def _search(self, text, pos=0):
+        for s in self.stop_regex:
+            if s.search(text, pos):
+                return True
+        return False
 
     def __call__(self, input_ids, scores, **kwargs):
         # Only look at the generated part
-        current_string = self.decode(
-            input_ids[0][self.prefix_length :], skip_special_tokens=False
+        generated = input_ids[0][self.prefix_length :]
+        searched_length = len(self.decoder.text)
+        current_string = self.decoder.add(generated[self.num_tokens :].tolist())
+        self.num_tokens = len(generated)
+
+        pos = 0
+        if self.max_length is not None:
+            pos = max(0, searched_length - self.max_length)
+        if not self._search(current_string, pos):
+            return False
+        # confirm on the full decoded text
+        return self._search(self.decode(generated, skip_special_tokens=False))
+
+
+class RegexLogitsProcessor(LogitsProcessor):
+    """
+    Masks the scores to the tokens that keep the generated text the prefix of a
+    match of a regex. Once the text is a full match, generation ends (EOS is
+    forced) when the most likely token does not continue the match.
+    """
+
+    def __init__(self, token_fsm: TokenFSM, prefix_length, eos_token_id):
+        self.token_fsm = token_fsm
+        self.prefix_length = prefix_length
+        self.eos_token_id = (
+            eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
         )
+        self.state = token_fsm.fsm.initial
+        self.num_tokens = 0
+        self.masks = {}  # state -> allowed tokens, as a tensor
 
-        for s in self.stop_regex:
-            if s.search(current_string):
-                return True
-        return False
+    def __call__(self, input_ids, scores):
+        generated = input_ids[0][self.prefix_length :].tolist()
+        for token in generated[self.num_tokens :]:
+            self.state = self.token_fsm.next_state(self.state, token)
+        self.num_tokens = len(generated)
+
+        allowed = self.masks.get(self.state)
+        if allowed is None:
+            allowed = torch.tensor(
+                self.token_fsm.allowed_tokens(self.state),
+                dtype=torch.long,
+                device=scores.device,
+            )
+            self.masks[self.state] = allowed
+        if self.token_fsm.fsm.is_accepting(self.state) or len(allowed) == 0:
+            if len(allowed) == 0 or not bool((allowed == scores[0].argmax()).any()):
+                allowed = torch.tensor(self.eos_token_id, device=scores.device)
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, allowed] = 0
+        return scores + mask
 
 
 class BiasLogitsProcessor(LogitsProcessor):
@@ -66,6 +199,329 @@ class BiasLogitsProcessor(LogitsProcessor):
 from .backend import PathFinder
 
 
+def _cache_layers(past_key_values):
+    """Per-layer (keys, values) of a DynamicCache, None if it cannot be shared."""
+    if past_key_values is None or not hasattr(past_key_values, "crop"):
+        return None  # legacy caches
+    if any(getattr(past_key_values, "is_sliding", None) or []):
+        return None  # sliding window layers drop the start of the prefix
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+
+def _common_length(a, b) -> int:
+    length = min(len(a), len(b))
+    mismatch = np.flatnonzero(np.asarray(a[:length]) != np.asarray(b[:length]))
+    return int(mismatch[0]) if len(mismatch) > 0 else length
+
+
+def _kv_bytes(kv) -> int:
+    return sum(keys.nbytes + values.nbytes for keys, values in kv)
+
+
+class _RadixNode:
+    __slots__ = ("tokens", "kv", "parent", "children", "last_access", "num_bytes")
+
+    def __init__(self, tokens, kv, parent) -> None:
+        self.tokens = tokens  # token ids of the edge from the parent
+        self.kv = kv  # per-layer (keys, values) of these tokens
+        self.parent = parent
+        self.children = {}  # first token of the edge -> child
+        self.last_access = 0
+        self.num_bytes = _kv_bytes(kv or [])
+
+
+class RadixKVCache:
+    """
+    KV cache of the previous generate calls, as a radix tree of token sequences
+    and their key/value blocks. A call only prefills the tokens after the longest
+    cached prefix of its prompt (e.g. the system prompt shared by all personas,
+    or the prompt of the previous call in the chain). Least recently used leaves
+    are evicted when the blocks take more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30) -> None:
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.root = _RadixNode((), None, None)
+        self.lock = threading.Lock()
+        self.clock = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _touch(self, node: _RadixNode):
+        self.clock += 1
+        node.last_access = self.clock
+
+    def take(self, input_ids: list[int]):
+        """
+        Returns a new cache holding the longest cached prefix of `input_ids` (None
+        if there is none), leaving at least one token to prefill.
+        """
+        tokens = input_ids[:-1]
+        with self.lock:
+            path = []
+            node, i = self.root, 0
+            while i < len(tokens):
+                child = node.children.get(tokens[i])
+                if child is None:
+                    break
+                length = _common_length(child.tokens, tokens[i:])
+                path.append((child, length))
+                self._touch(child)
+                node, i = child, i + length
+                if length < len(child.tokens):
+                    break
+
+            self.lookups += 1
+            self.prompt_tokens += len(input_ids)
+            if i == 0:
+                return None
+            self.hits += 1
+            self.cached_tokens += i
+            layers = [
+                [
+                    (keys[:, :, :length], values[:, :, :length])
+                    for keys, values in node.kv
+                ]
+                for node, length in path
+            ]
+        # the views keep the blocks alive if they are evicted, copy them unlocked
+        past_key_values = DynamicCache()
+        for layer_idx, blocks in enumerate(zip(*layers)):
+            past_key_values.update(
+                torch.cat([keys for keys, _ in blocks], dim=-2),
+                torch.cat([values for _, values in blocks], dim=-2),
+                layer_idx,
+            )
+        return past_key_values
+
+    def put(self, sequence: list[int], past_key_values):
+        """Adds the KV blocks of a generate call, keyed by its token sequence."""
+        layers = _cache_layers(past_key_values)
+        if layers is None:
+            return
+        tokens = tuple(sequence[: past_key_values.get_seq_length()])
+        with self.lock:
+            node, i = self.root, 0
+            while i < len(tokens):
+                child = node.children.get(tokens[i])
+                if child is None:
+                    child = _RadixNode(
+                        tokens[i:],
+                        [
+                            (keys[:, :, i:].clone(), values[:, :, i:].clone())
+                            for keys, values in layers
+                        ],
+                        node,
+                    )
+                    node.children[tokens[i]] = child
+                    self.num_bytes += child.num_bytes
+                    self._touch(child)
+                    break
+                length = _common_length(child.tokens, tokens[i:])
+                if length < len(child.tokens):
+                    child = self._split(child, length)
+                self._touch(child)
+                node, i = child, i + length
+            self._evict()
+
+    def _split(self, node: _RadixNode, length: int) -> _RadixNode:
+        """Splits the edge of `node` after `length` tokens, returns the new parent."""
+        parent = _RadixNode(
+            node.tokens[:length],
+            [
+                (keys[:, :, :length].clone(), values[:, :, :length].clone())
+                for keys, values in node.kv
+            ],
+            node.parent,
+        )
+        parent.last_access = node.last_access
+        node.parent.children[node.tokens[0]] = parent
+        parent.children[node.tokens[length]] = node
+        self.num_bytes -= node.num_bytes
+        node.tokens = node.tokens[length:]
+        node.kv = [
+            (keys[:, :, length:].clone(), values[:, :, length:].clone())
+            for keys, values in node.kv
+        ]
+        node.parent = parent
+        node.num_bytes = _kv_bytes(node.kv)
+        self.num_bytes += parent.num_bytes + node.num_bytes
+        return parent
+
+    def _evict(self):
+        if self.num_bytes <= self.max_bytes:
+            return
+        leaves = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+            if not node.children and node is not self.root:
+                leaves.append(node)
+        heap = [(leaf.last_access, id(leaf), leaf) for leaf in leaves]
+        heapq.heapify(heap)
+        while heap and self.num_bytes > self.max_bytes:
+            _, _, leaf = heapq.heappop(heap)
+            parent = leaf.parent
+            del parent.children[leaf.tokens[0]]
+            self.num_bytes -= leaf.num_bytes
+            if parent is not self.root and not parent.children:
+                heapq.heappush(heap, (parent.last_access, id(parent), parent))
+
+    def stats(self) -> dict:
+        """Hit rates and memory use of the cache."""
+        with self.lock:
+            num_nodes = 0
+            stack = list(self.root.children.values())
+            while stack:
+                node = stack.pop()
+                num_nodes += 1
+                stack.extend(node.children.values())
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "token_hit_rate": (
+                    self.cached_tokens / self.prompt_tokens
+                    if self.prompt_tokens
+                    else 0.0
+                ),
+                "num_bytes": self.num_bytes,
+                "max_bytes": self.max_bytes,
+                "num_nodes": num_nodes,
+            }
+
+
+class GenerationSession:
+    """
+    Generation settings of a model resolved once, instead of loading the configs
+    and decoding the EOS tokens on every gen/find/select call.
+    """
+
+    def __init__(
+        self,
+        model: PreTrainedModel,
+        tokenizer: PreTrainedTokenizer,
+        trust_remote_code: bool = False,
+        reuse_kv_cache: bool = True,
+        kv_cache_bytes: int = 1 << 30,
+    ) -> None:
+        self.tokenizer = tokenizer
+        # shared by all the copies of the model, see `RadixKVCache`
+        self.kv_cache = RadixKVCache(kv_cache_bytes) if reuse_kv_cache else None
+
+        generation_config = GenerationConfig.from_pretrained(
+            model.name_or_path,
+            trust_remote_code=trust_remote_code,
+        )
+        pad_token_id = generation_config.pad_token_id
+        eos_token_id = generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        if pad_token_id is None:
+            pad_token_id = (
+                eos_token_id[0] if isinstance(eos_token_id, list) else eos_token_id
+            )
+        generation_config.update(pad_token_id=pad_token_id, eos_token_id=eos_token_id)
+        self.generation_config = generation_config
+        self.pad_token_id = pad_token_id
+        self.eos_token_id = eos_token_id
+
+        # (decoded eos, number of characters to strip)
+        if isinstance(eos_token_id, list):
+            self.eos_strings = [
+                (tokenizer.decode(eos_id), len(tokenizer.decode(eos_id)))
+                for eos_id in eos_token_id
+            ]
+        else:
+            self.eos_strings = [
+                (tokenizer.decode(eos_token_id), len(tokenizer.eos_token))
+            ]
+
+        self.lock = threading.Lock()
+        self._token_vocabulary = None
+        self._token_fsms = {}
+
+        # only the logits of the last token are needed by select
+        parameters = inspect.signature(model.forward).parameters
+        self.forward_kwargs = {}
+        if "logits_to_keep" in parameters:
+            self.forward_kwargs["logits_to_keep"] = 1
+        elif "num_logits_to_keep" in parameters:
+            self.forward_kwargs["num_logits_to_keep"] = 1
+
+    def generation_config_for(self, value) -> GenerationConfig:
+        """Generation config of a gen/find call."""
+        generation_config = copy.deepcopy(self.generation_config)
+        generation_config.update(
+            max_new_tokens=value.max_tokens,
+            **(
+                {
+                    "temperature": value.temperature,
+                    "do_sample": True,
+                    "top_p": value.top_p,
+                }
+                if value.temperature != 0.0
+                else {
+                    "do_sample": False,
+                    "temperature": 1.0,
+                    "top_p": 1.0,
+                }
+            ),
+        )
+        return generation_config
+
+    def token_vocabulary(self) -> list[tuple[int, str]]:
+        """
+        (token id, decoded text) of the tokens that can be generated, without the
+        special tokens and the tokens that are not valid text on their own.
+        """
+        with self.lock:
+            if self._token_vocabulary is None:
+                tokenizer = self.tokenizer
+                # decoded after an anchor token, so the leading spaces of
+                # sentencepiece tokens are kept
+                anchor = tokenizer.encode("0", add_special_tokens=False)[-1]
+                anchor_length = len(tokenizer.decode([anchor]))
+                special = set(tokenizer.all_special_ids)
+                tokens = [t for t in range(len(tokenizer)) if t not in special]
+                texts = tokenizer.batch_decode(
+                    [[anchor, token] for token in tokens],
+                    clean_up_tokenization_spaces=False,
+                )
+                self._token_vocabulary = [
+                    (token, text[anchor_length:])
+                    for token, text in zip(tokens, texts)
+                    if len(text) > anchor_length and "\ufffd" not in text
+                ]
+            return self._token_vocabulary
+
+    def token_fsm(self, pattern: str) -> TokenFSM:
+        """
+        Token-level FSM of a regex, built once per pattern.
+
+        Raises:
+            UnsupportedRegex: if the regex has no finite-state equivalent
+        """
+        token_fsm = self._token_fsms.get(pattern)
+        if token_fsm is None:
+            token_fsm = TokenFSM(compile_fsm(pattern), self.token_vocabulary())
+            self._token_fsms[pattern] = token_fsm
+        return token_fsm
+
+    def strip_eos(self, res: str) -> str:
+        for eos, length in self.eos_strings:
+            if res.endswith(eos):
+                return res[:-length]
+        return res
+
+
 class Model(PathFinder):
     def __init__(
         self,
@@ -73,6 +529,7 @@ class Model(PathFinder):
         tokenizer: PreTrainedTokenizer,
         trust_remote_code: bool = False,
         template: Any = None,
+        session: GenerationSession = None,
     ) -> None:
         super().__init__(model.name_or_path)
         self.model = model
@@ -80,6 +537,38 @@ class Model(PathFinder):
         self.tokenizer = tokenizer
 
         self.trust_remote_code = trust_remote_code
+        if session is None:
+            session = GenerationSession(model, tokenizer, trust_remote_code)
+        self.session = session
+
+        self.fused = False
+        self.fused_max_tokens = 1000
+        self.fused_block = None  # chat entry the buffered text was generated for
+
+    def enable_fused(self, max_tokens=1000):
+        """
+        Generate the rest of an assistant block once, and parse the following
+        gen/find/select out of the generated text (consumed like in the API and
+        vLLM backends) instead of running a generate call for each. A find or
+        select that cannot be parsed falls back to its own generate call.
+        """
+        self.fused = True
+        self.fused_max_tokens = max_tokens
+
+    def _consume_assistant_text(self, value):
+        if not self.fused:
+            return
+        self.prefix_text += value
+        match = regex.match(
+            r"(.*?)" + regex.escape(value) + r"(.*?)",
+            self.text_to_consume,
+            regex.DOTALL,
+        )
+        if match:
+            self.text_to_consume = self.text_to_consume[len(match.group()) :]
+            self.prefix_text = ""
+        else:
+            self.text_to_consume = ""
 
     def _current_prompt(self):
         if isinstance(self.chat, list):
@@ -93,7 +582,7 @@ class Model(PathFinder):
             prompt_render = self.chat
         return prompt_render
 
-    def _format_prompt(self):
+    def _render_prompt(self):
         if isinstance(self.chat, list):
             tmp_chat = (
                 self.chat[:-1]
@@ -112,50 +601,112 @@ class Model(PathFinder):
             )
         else:
             prompt_render = self.chat
+        return prompt_render
 
+    def _format_prompt(self):
+        prompt_render = self._render_prompt()
         input_ids = self.tokenizer(
             prompt_render, return_tensors="pt", add_special_tokens=True
         ).input_ids.to(self.model.device)
         return prompt_render, input_ids
 
-    def _get_gen(self, value: Gen):
+    def _generate(self, input_ids, generation_config, **kwargs):
+        """`model.generate`, prefilling only the tokens not in the session KV cache."""
+        kv_cache = self.session.kv_cache
+        past_key_values = None
+        if kv_cache is not None:
+            past_key_values = kv_cache.take(input_ids[0].tolist())
+        output = self.model.generate(
+            inputs=input_ids,
+            generation_config=generation_config,
+            past_key_values=past_key_values,
+            return_dict_in_generate=True,
+            **kwargs,
+        )
+        if kv_cache is not None:
+            kv_cache.put(output.sequences[0].tolist(), output.past_key_values)
+        return output
+
+    def _fill_text_to_consume(self, temperature=0.0, top_p=1.0):
+        """Generates the rest of the assistant block, unless it is buffered."""
+        if self.fused_block != len(self._chat):
+            self.text_to_consume = ""  # generated for a previous block
+        if self.text_to_consume != "":
+            self.token_in = self.token_out = 0
+            return
         prompt_render, input_ids = self._format_prompt()
-
-        generation_config = GenerationConfig.from_pretrained(
-            self.model.name_or_path,
-            trust_remote_code=self.trust_remote_code,
+        generation_config = self.session.generation_config_for(
+            Gen(
+                "fused",
+                self.fused_max_tokens,
+                temperature,
+                top_p,
+                1.0,
+                None,
+                False,
+            )
         )
+        output = self._generate(input_ids, generation_config).sequences
+        self.text_to_consume = self.session.strip_eos(
+            self.tokenizer.decode(
+                output[0][input_ids.shape[1] :], skip_special_tokens=False
+            )
+        )
+        self.fused_block = len(self._chat)
+        self.prefix_text = ""
+        self.token_in = len(input_ids[0])
+        self.token_out = len(output[0]) - len(input_ids[0])
 
-        pad_token_id = generation_config.pad_token_id
-        eos_token_id = generation_config.eos_token_id
-        if eos_token_id is None:
-            eos_token_id = self.tokenizer.eos_token_id
-        if pad_token_id is None:
-            pad_token_id = (
-                eos_token_id[0] if isinstance(eos_token_id, list) else eos_token_id
+    def _consume_gen(self, value: Gen):
+        self._fill_text_to_consume(value.temperature, value.top_p)
+        text = self.text_to_consume
+        end = len(text)
+        if value.stop_regex:
+            stop_regex, _ = compile_stop_regex(
+                value.stop_regex
+                if isinstance(value.stop_regex, str)
+                else tuple(value.stop_regex)
             )
-        generation_config.update(
-            pad_token_id=pad_token_id,
-            eos_token_id=eos_token_id,
-            max_new_tokens=value.max_tokens,
-            **(
-                {
-                    "temperature": value.temperature,
-                    "do_sample": True,
-                    "top_p": value.top_p,
-                }
-                if value.temperature != 0.0
-                else {
-                    "do_sample": False,
-                    "temperature": 1.0,
-                    "top_p": 1.0,
-                }
-            ),
+            matches = [m for m in (p.search(text) for p in stop_regex) if m]
+            if matches:
+                match = min(matches, key=lambda m: m.start())
+                end = match.end() if value.save_stop_text else match.start()
+        # without a stop, the generation ended: the rest of the text is the field
+        self.text_to_consume = text[end:]
+        return text[:end]
+
+    def _consume_find(self, value: Find):
+        self._fill_text_to_consume(value.temperature, value.top_p)
+        match = regex.search(value.regex, self.text_to_consume)
+        if match is None:
+            return None
+        original_res = self.text_to_consume[: match.end()]
+        self.text_to_consume = self.text_to_consume[match.end() :]
+        self._variables[f"PATHFINDER_ORIGINAL_{value.name}"] = original_res
+        return match.group(0), original_res
+
+    def _consume_select(self, value: Select):
+        self._fill_text_to_consume()
+        options = sorted(value.options, key=len, reverse=True)  # "10" before "1"
+        match = regex.match(
+            r"\s*(" + "|".join(regex.escape(option) for option in options) + ")",
+            self.text_to_consume,
         )
+        if match is None:
+            return None
+        self.text_to_consume = self.text_to_consume[match.end() :]
+        return match.group(1)
 
-        output = self.model.generate(
-            inputs=input_ids,
-            generation_config=generation_config,
+    def _get_gen(self, value: Gen):
+        if self.fused:
+            return self._consume_gen(value)
+        prompt_render, input_ids = self._format_prompt()
+
+        generation_config = self.session.generation_config_for(value)
+
+        output = self._generate(
+            input_ids,
+            generation_config,
             stopping_criteria=(
                 StoppingCriteriaList(
                     [
@@ -169,27 +720,18 @@ class Model(PathFinder):
                 if value.stop_regex
                 else None
             ),
-        )
+        ).sequences
 
         res = self.tokenizer.decode(
             output[0][input_ids.shape[1] :], skip_special_tokens=False
         )
-        # use generation_config.eos_token_id, can be a list or a single value, detokenize and remove eos token
-        if isinstance(eos_token_id, list):
-            for eos_id in eos_token_id:
-                eos = self.tokenizer.decode(eos_id)
-                if res.endswith(eos):
-                    res = res[: -len(eos)]
-                    break
-        else:
-            eos = self.tokenizer.decode(eos_token_id)
-            if res.endswith(eos):
-                res = res[: -len(self.tokenizer.eos_token)]
+        res = self.session.strip_eos(res)
         if not value.save_stop_text and value.stop_regex is not None:
-            if isinstance(value.stop_regex, str):
-                stop_regex = [regex.compile(value.stop_regex)]
-            else:
-                stop_regex = [regex.compile(pattern) for pattern in value.stop_regex]
+            stop_regex, _ = compile_stop_regex(
+                value.stop_regex
+                if isinstance(value.stop_regex, str)
+                else tuple(value.stop_regex)
+            )
 
             for p in stop_regex:
                 if p.search(res):
@@ -201,41 +743,35 @@ class Model(PathFinder):
         return res
 
     def _get_find(self, value: Find):
+        if self.fused:
+            res = self._consume_find(value)
+            if res is not None:
+                return res
+            self.text_to_consume = ""  # not in the generated text, generate it alone
         prompt_render, input_ids = self._format_prompt()
-        generation_config = GenerationConfig.from_pretrained(
-            self.model.name_or_path,
-            trust_remote_code=self.trust_remote_code,
-        )
-
-        pad_token_id = generation_config.pad_token_id
-        eos_token_id = generation_config.eos_token_id
-        if eos_token_id is None:
-            eos_token_id = self.tokenizer.eos_token_id
-        if pad_token_id is None:
-            pad_token_id = (
-                eos_token_id[0] if isinstance(eos_token_id, list) else eos_token_id
-            )
-        generation_config.update(
-            pad_token_id=pad_token_id,
-            eos_token_id=eos_token_id,
-            max_new_tokens=value.max_tokens,
-            **(
-                {
-                    "temperature": value.temperature,
-                    "do_sample": True,
-                    "top_p": value.top_p,
-                }
-                if value.temperature != 0.0
-                else {
-                    "do_sample": False,
-                    "temperature": 1.0,
-                    "top_p": 1.0,
-                }
-            ),
-        )
-        output = self.model.generate(
-            inputs=input_ids,
-            generation_config=generation_config,
+        generation_config = self.session.generation_config_for(value)
+        logits_processor = None
+        if value.constrained:
+            try:
+                token_fsm = self.session.token_fsm(
+                    constrained_find_pattern(value.regex)
+                )
+            except UnsupportedRegex:
+                pass  # generate unconstrained and search the text
+            else:
+                logits_processor = LogitsProcessorList(
+                    [
+                        RegexLogitsProcessor(
+                            token_fsm,
+                            input_ids.shape[1],
+                            self.session.eos_token_id,
+                        )
+                    ]
+                )
+        output = self._generate(
+            input_ids,
+            generation_config,
+            logits_processor=logits_processor,
             stopping_criteria=(
                 StoppingCriteriaList(
                     [
@@ -249,23 +785,13 @@ class Model(PathFinder):
                 if value.stop_regex
                 else None
             ),
-        )
+        ).sequences
 
         res = self.tokenizer.decode(
             output[0][input_ids.shape[1] :], skip_special_tokens=False
         )
 
-        # use generation_config.eos_token_id, can be a list or a single value, detokenize and remove eos token
-        if isinstance(eos_token_id, list):
-            for eos_id in eos_token_id:
-                eos = self.tokenizer.decode(eos_id)
-                if res.endswith(eos):
-                    res = res[: -len(eos)]
-                    break
-        else:
-            eos = self.tokenizer.decode(eos_token_id)
-            if res.endswith(eos):
-                res = res[: -len(self.tokenizer.eos_token)]
+        res = self.session.strip_eos(res)
         # remove end pattern if it exists and save_stop_text is True
         original_res = res
         self._variables[f"PATHFINDER_ORIGINAL_{value.name}"] = res
@@ -278,90 +804,154 @@ class Model(PathFinder):
         self.token_out = len(output[0]) - len(input_ids[0])
         return res, original_res
 
-    def _get_select(self, value: Select):
-        prompt_render, input_ids = self._format_prompt()
-        model_config = AutoConfig.from_pretrained(
-            self.model.name_or_path, trust_remote_code=self.trust_remote_code
-        )
-        pad_token_id = model_config.pad_token_id
-        eos_token_id = model_config.eos_token_id
-        if eos_token_id is None:
-            eos_token_id = self.tokenizer.eos_token_id
-        if pad_token_id is None:
-            pad_token_id = eos_token_id
+    def _forward(self, tokens, past_key_values=None):
+        """
+        Forward pass over `tokens` after `past_key_values`. Without a cache, only the
+        tokens not in the session KV cache are prefilled.
+        """
+        kv_cache = self.session.kv_cache
+        if past_key_values is None and kv_cache is not None:
+            past_key_values = kv_cache.take(tokens)
+            if past_key_values is not None:
+                tokens = tokens[past_key_values.get_seq_length() :]
+        with torch.no_grad():
+            return self.model(
+                input_ids=torch.tensor([tokens], device=self.model.device),
+                past_key_values=past_key_values,
+                use_cache=True,
+                **self.session.forward_kwargs,
+            )
 
-        generation_config = GenerationConfig(
-            pad_token_id=pad_token_id,
-            eos_token_id=eos_token_id,
-            max_new_tokens=1,
-            return_dict_in_generate=True,
-            output_scores=True,
-            renormalize_logits=True,
+    def _tokenize_options(self, prompt_render, options):
+        """
+        Token ids of the prompt, and of each option following it. The prompt tokens
+        that merge with the start of an option are moved to the options.
+
+        Only the last few tokens of the prompt are tokenized again with each option,
+        unless the tokenizer cannot tell where they start in the text.
+        """
+        tokenizer = self.tokenizer
+        encoding = tokenizer(
+            prompt_render,
+            add_special_tokens=True,
+            return_offsets_mapping=tokenizer.is_fast,
+        )
+        prompt_ids = encoding.input_ids
+        tail = len(prompt_ids) - SELECT_RETOKENIZED_TOKENS
+        if tokenizer.is_fast and tail > 0:
+            tail_text = prompt_render[encoding.offset_mapping[tail][0] :]
+            tail_ids = tokenizer.encode(tail_text, add_special_tokens=False)
+            if tail_ids != prompt_ids[tail:]:
+                tail = 0  # e.g. sentencepiece adds a prefix space to the tail
+        else:
+            tail = 0
+        if tail > 0:
+            sequences = [
+                tokenizer.encode(tail_text + option, add_special_tokens=False)
+                for option in options
+            ]
+        else:
+            sequences = [
+                tokenizer.encode(prompt_render + option, add_special_tokens=True)
+                for option in options
+            ]
+        length = min(
+            _common_length(prompt_ids[tail:], sequence) for sequence in sequences
         )
+        return prompt_ids[: tail + length], [
+            sequence[length:] for sequence in sequences
+        ]
 
-        options_text = [
-            self.tokenizer.decode(
-                self.tokenizer.encode(prompt_render + option, add_special_tokens=True),
-                skip_special_tokens=False,
-            )
-            for option in value.options
+    def _get_select(self, value: Select):
+        if self.fused:
+            res = self._consume_select(value) if value.scoring == "greedy" else None
+            if res is not None:
+                return res
+            self.text_to_consume = ""  # not in the generated text, score the options
+        prompt_ids, options_ids = self._tokenize_options(
+            self._render_prompt(), value.options
+        )
+        if value.scoring == "loglik":
+            return self._select_loglik(value, prompt_ids, options_ids)
+
+        trie = Trie(options_ids)
+        option_index = {}
+        for i, option_ids in enumerate(options_ids):
+            option_index.setdefault(tuple(option_ids), i)
+
+        # greedy walk down the trie: at each step take the most likely token that
+        # continues an option, and stop at a complete option unless the most likely
+        # token overall continues it
+        output = self._forward(prompt_ids)
+        selected = []
+        allowed = trie.get(selected)
+        while allowed:
+            logits = output.logits[0, -1]
+            if tuple(selected) in option_index and int(logits.argmax()) not in allowed:
+                break
+            token = allowed[int(logits[allowed].argmax())]
+            selected.append(token)
+            allowed = trie.get(selected)
+            if allowed:
+                output = self._forward([token], output.past_key_values)
+
+        if self.session.kv_cache is not None:
+            self.session.kv_cache.put(prompt_ids + selected, output.past_key_values)
+        self.token_in = len(prompt_ids)
+        self.token_out = len(selected)
+        return value.options[option_index[tuple(selected)]]
+
+    def _select_loglik(self, value: Select, prompt_ids, options_ids):
+        """
+        Scores the log-likelihood of every option, in a single batched forward pass
+        over the options that share the prompt KV cache.
+        """
+        output = self._forward(prompt_ids)
+        past_key_values = output.past_key_values
+        if self.session.kv_cache is not None:
+            self.session.kv_cache.put(prompt_ids, past_key_values)
+        first_logprobs = torch.log_softmax(output.logits[0, -1].float(), dim=-1)
+        logprobs = [
+            float(first_logprobs[option_ids[0]]) if option_ids else 0.0
+            for option_ids in options_ids
         ]
-        # build a trie of the options
-        token_map = pygtrie.Trie()
-        for i, option in enumerate(options_text):
-            token_map[option] = option
-
-        # hack to deal with sentencepiece "" empty
-        prefix = input_ids[0].tolist()
-        if self.tokenizer.decode(prefix[-1]) == "":
-            prefix = prefix[:-1]
-        prefix = tuple(prefix)
-        prompt_length = len(prefix)
-        full_match = False
-        need_more_tokens = True
-        while need_more_tokens:
-            # generate the token logprobs
-            gen_obj = self.model.generate(
-                inputs=torch.tensor([prefix], device=self.model.device),
-                generation_config=generation_config,
-            )
-            logprobs_result = gen_obj.scores[0][0].to(dtype=torch.float32).cpu().numpy()
 
-            top_logprobs = np.argsort(-logprobs_result)
+        # the options are padded on the right, so no token attends to the padding
+        length = max(len(option_ids) for option_ids in options_ids) - 1
+        if length > 0:
 
-            for i, token in enumerate(top_logprobs):
-                # check if the token is in the trie
-                current_prefix = prefix + (token,)
-                current_prefix_decoded = self.tokenizer.decode(
-                    current_prefix, skip_special_tokens=False
-                )
-                try:
-                    extension_options = token_map.items(prefix=current_prefix_decoded)
-                    partial_match = True
-                except KeyError:
-                    partial_match = False
-                if partial_match:
-                    prefix = current_prefix
-
-                    for e in extension_options:
-                        if e[1] == current_prefix_decoded:
-                            # we have a full match
-                            full_match = True
-                            if len(extension_options) == 1:
-                                # we have a unique match
-                                need_more_tokens = False
-                            break
-                    break
-                else:
-                    # we have not found a partial match
-                    if i == 0 and full_match:
-                        # we had a full match before, so we are done
-                        need_more_tokens = False
-                        break
-
-        res = self.tokenizer.decode(prefix[prompt_length:], skip_special_tokens=False)
-        self.token_in = prompt_length
-        self.token_out = len(prefix) - prompt_length
-        if res.endswith(self.tokenizer.eos_token):
-            res = res[: -len(self.tokenizer.eos_token)]
-        return res
+            def pad(tokens):
+                return tokens + [0] * (length - len(tokens))
+
+            input_ids = torch.tensor(
+                [pad(option_ids[:-1]) for option_ids in options_ids],
+                device=self.model.device,
+            )
+            targets = torch.tensor(
+                [pad(option_ids[1:]) for option_ids in options_ids],
+                device=self.model.device,
+            )
+            mask = torch.tensor(
+                [pad([1] * len(option_ids[1:])) for option_ids in options_ids],
+                device=self.model.device,
+            )
+            past_key_values.batch_repeat_interleave(len(options_ids))
+            with torch.no_grad():
+                logits = self.model(
+                    input_ids=input_ids,
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                ).logits
+            token_logprobs = torch.log_softmax(logits.float(), dim=-1)
+            token_logprobs = token_logprobs.gather(-1, targets.unsqueeze(-1))
+            option_logprobs = (token_logprobs.squeeze(-1) * mask).sum(dim=-1)
+            logprobs = [
+                logprob + float(option_logprob)
+                for logprob, option_logprob in zip(logprobs, option_logprobs)
+            ]
+
+        best = int(np.argmax(logprobs))
+        self._variables[f"{value.name}_logprobs"] = dict(zip(value.options, logprobs))
+        self.token_in = len(prompt_ids)
+        self.token_out = len(options_ids[best])
+        return value.options[best]
@@ -0,0 +1,112 @@
+"""
+Backend running the gen/find/select of a model kept loaded by a `pathfinder serve`
+daemon, so that several processes share one warm model.
+"""
+
+import json
+import os
+import socket
+import tempfile
+import threading
+
+from ._find import Find
+from ._gen import Gen
+from ._select import Select
+from .backend import PathFinder
+
+PRIMITIVES = {"gen": Gen, "find": Find, "select": Select}
+
+
+def default_address():
+    """Socket of the server: `PATHFINDER_SOCKET`, or a per-user path in /tmp."""
+    return os.environ.get("PATHFINDER_SOCKET") or os.path.join(
+        tempfile.gettempdir(), f"pathfinder-{os.getuid()}.sock"
+    )
+
+
+class RemoteError(Exception):
+    """A request failed in the server."""
+
+
+class Connection:
+    """Connection to the server, requests and responses are JSON lines."""
+
+    def __init__(self, address) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.file = self.sock.makefile("rwb")
+
+    def call(self, request: dict) -> dict:
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The pathfinder server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RemoteError(f"{response['type']}: {response['error']}")
+        return response
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class ModelRemote(PathFinder):
+    """
+    Model `model_name` of the server listening on `address`. Each gen/find/select
+    sends the chat and runs on the server, which is stateless: text generated past
+    a primitive is not kept for the next one.
+    """
+
+    def __init__(self, model_name, seed=42, address=None) -> None:
+        super().__init__(model_name)
+        self.address = address or default_address()
+        # copies run their chains on several threads, one connection per thread
+        self._local = threading.local()
+        self._call("load", seed=seed)
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = Connection(self.address)
+        return connection
+
+    def _call(self, op, **kwargs) -> dict:
+        request = {"op": op, "model": self.model_name, **kwargs}
+        try:
+            return self._connection().call(request)
+        except OSError:
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                raise
+            # the server restarted, the requests do not depend on the connection
+            connection.close()
+            self._local.connection = None
+            return self._connection().call(request)
+
+    def _current_prompt(self):
+        if isinstance(self.chat, list):
+            return str(self.chat)
+        return self.chat
+
+    def _run(self, kind, value) -> dict:
+        response = self._call("run", chat=self.chat, kind=kind, params=vars(value))
+        self._variables.update(response["variables"])
+        self.token_in = response["token_in"]
+        self.token_out = response["token_out"]
+        return response
+
+    def _get_gen(self, value: Gen):
+        return self._run("gen", value)["result"]
+
+    def _get_find(self, value: Find):
+        response = self._run("find", value)
+        return response["result"], response["original"]
+
+    def _get_select(self, value: Select):
+        return self._run("select", value)["result"]
+
+    def stats(self) -> dict:
+        """Models loaded by the server, see `loaded_models`."""
+        return self._call("stats")
@@ -0,0 +1,151 @@
+"""
+`pathfinder serve`: a daemon keeping models loaded and running the gen/find/select
+of `ModelRemote` clients (`get_model(..., backend_name="remote")`), so that the
+processes of a sweep share one warm model instead of each loading it.
+
+    pathfinder serve --backend vllm --model meta-llama/Meta-Llama-3-8B-Instruct
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from ._find import Find
+from .loader import get_model, loaded_models
+from .remote import PRIMITIVES, default_address
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                logging.warning(f"pathfinder server: {type(e).__name__}: {e}")
+                response = {"error": str(e), "type": type(e).__name__}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+def _remove_stale_socket(address):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        os.unlink(address)  # left by a server that did not shut down
+    else:
+        raise RuntimeError(f"A pathfinder server is already listening on {address}")
+    finally:
+        sock.close()
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves each connection on its own thread. The models are loaded on first use
+    with `get_model`, so each is loaded once, and vLLM models batch the requests
+    of concurrent clients.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, address, backend_name="transformers", seed=42, kv_cache_bytes=None
+    ) -> None:
+        if os.path.exists(address):
+            _remove_stale_socket(address)
+        super().__init__(address, _Handler)
+        self.backend_name = backend_name
+        self.seed = seed
+        self.kv_cache_bytes = kv_cache_bytes
+        self._lock = threading.Lock()
+
+    def model(self, name, seed=None):
+        with self._lock:
+            model = get_model(
+                name,
+                False,
+                self.seed if seed is None else seed,
+                self.backend_name,
+                kv_cache_bytes=self.kv_cache_bytes,
+            )
+            if self.backend_name == "vllm" and model.batcher is None:
+                model.enable_batching()
+        return model
+
+    def dispatch(self, request: dict) -> dict:
+        op = request["op"]
+        if op == "load":
+            self.model(request["model"], request.get("seed"))
+            return {}
+        if op == "run":
+            lm = self.model(request["model"]).copy()
+            lm.chat = request["chat"]
+            lm._variables = {}
+            value = PRIMITIVES[request["kind"]](**request["params"])
+            if isinstance(value, Find):
+                result, original = lm._get_find(value)
+            else:
+                result = original = getattr(lm, f"_get_{request['kind']}")(value)
+            return {
+                "result": result,
+                "original": original,
+                "variables": lm._variables,
+                "token_in": lm.token_in,
+                "token_out": lm.token_out,
+            }
+        if op == "stats":
+            return {"models": loaded_models()}
+        raise ValueError(f"Unknown request {op}")
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pathfinder")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="keep models loaded for clients")
+    serve.add_argument(
+        "--socket",
+        default=None,
+        help="default: $PATHFINDER_SOCKET or /tmp/pathfinder-<uid>.sock",
+    )
+    serve.add_argument(
+        "--backend", default="transformers", choices=["transformers", "vllm"]
+    )
+    serve.add_argument(
+        "--model", action="append", default=[], help="model to load at startup"
+    )
+    serve.add_argument("--seed", type=int, default=42)
+    serve.add_argument(
+        "--kv-cache-bytes",
+        type=int,
+        default=None,
+        help="transformers backend, default: 1 GiB on CPU, 0 (off) on GPU",
+    )
+    args = parser.parse_args(argv)
+
+    server = ModelServer(
+        args.socket or default_address(), args.backend, args.seed, args.kv_cache_bytes
+    )
+    try:
+        for name in args.model:
+            server.model(name)
+        for entry in loaded_models():
+            print(f"Loaded model: {entry}")
+        print(f"Serving on {server.server_address}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
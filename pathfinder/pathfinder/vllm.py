@@ -1,4 +1,7 @@
+import bisect
 import copy
+import threading
+import time
 from typing import Any
 
 import numpy as np
@@ -19,10 +22,20 @@ from transformers import (
 )
 from vllm import LLM, SamplingParams
 
+try:
+    from vllm.sampling_params import StructuredOutputsParams
+except ImportError:  # vllm < 0.10.2
+    StructuredOutputsParams = None
+try:
+    from vllm.sampling_params import GuidedDecodingParams
+except ImportError:  # vllm < 0.6.3, or removed in favor of StructuredOutputsParams
+    GuidedDecodingParams = None
+
 from ._find import Find
 from ._gen import Gen
 from ._select import Select
 from .backend import PathFinder
+from .fsm import constrained_find_pattern, literal_alternatives
 from .trie import MarisaTrie, Trie
 
 
@@ -34,6 +47,147 @@ def can_be_int(s):
         return False  # Return False if a ValueError is raised
 
 
+def guided_regex_params(pattern):
+    """SamplingParams arguments constraining the output to match `pattern`."""
+    if StructuredOutputsParams is not None:
+        return {"structured_outputs": StructuredOutputsParams(regex=pattern)}
+    if GuidedDecodingParams is not None:
+        return {"guided_decoding": GuidedDecodingParams(regex=pattern)}
+    return {}  # vllm without guided decoding, generate unconstrained
+
+
+class Histogram:
+    """Number of values in each bucket, given the upper bounds of the buckets."""
+
+    def __init__(self, bounds) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        buckets = {
+            f"<={bound}": count for bound, count in zip(self.bounds, self.counts)
+        }
+        buckets[f">{self.bounds[-1]}"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class _PendingRequest:
+    def __init__(self, input_ids, sampling_params) -> None:
+        self.input_ids = input_ids
+        self.sampling_params = sampling_params
+        self.output = None
+        self.error = None
+        self.done = False
+        self.arrival = time.monotonic()
+
+
+class RequestBatcher:
+    """
+    Coalesces the requests made concurrently from several threads into a single
+    `LLM.generate` call.
+
+    A request waits until `max_wait` seconds pass without new requests, or until
+    `max_batch_size` requests are pending; then one of the waiting threads runs the
+    batch for all of them.
+
+    The batch sizes, the time the requests wait for their batch and their total
+    latency are recorded, see `stats`, to tune `max_wait`.
+    """
+
+    def __init__(self, llm: LLM, max_batch_size=256, max_wait=0.02) -> None:
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._pending = []
+        self._last_arrival = 0.0
+        self._running = False
+
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        latency_bounds = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+        self.queue_waits = Histogram(latency_bounds)
+        self.latencies = Histogram(latency_bounds)
+
+    def stats(self) -> dict:
+        """Histograms of the batch sizes, and of the queue waits and latencies (s)."""
+        with self._condition:
+            return {
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_wait": self.queue_waits.snapshot(),
+                "latency": self.latencies.snapshot(),
+            }
+
+    def _batch_wait(self):
+        """
+        Returns None if the pending requests should run now, otherwise how long to
+        wait (0 for until notified).
+        """
+        if self._running or len(self._pending) == 0:
+            return 0
+        if len(self._pending) >= self.max_batch_size:
+            return None
+        idle = time.monotonic() - self._last_arrival
+        if idle >= self.max_wait:
+            return None
+        return self.max_wait - idle
+
+    def _run(self, batch):
+        try:
+            outputs = self.llm.generate(
+                prompt_token_ids=[request.input_ids for request in batch],
+                sampling_params=[request.sampling_params for request in batch],
+                use_tqdm=False,
+            )
+            for request, output in zip(batch, outputs):
+                request.output = output.outputs[0].text
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done = True
+
+    def generate(self, input_ids, sampling_params) -> str:
+        request = _PendingRequest(input_ids, sampling_params)
+        with self._condition:
+            self._pending.append(request)
+            self._last_arrival = time.monotonic()
+            self._condition.notify_all()
+            while not request.done:
+                wait = self._batch_wait()
+                if wait is not None:
+                    self._condition.wait(timeout=wait or None)
+                    continue
+                batch = self._pending[: self.max_batch_size]
+                del self._pending[: self.max_batch_size]
+                self._running = True
+                start = time.monotonic()
+                self.batch_sizes.add(len(batch))
+                for pending in batch:
+                    self.queue_waits.add(start - pending.arrival)
+                self._condition.release()
+                try:
+                    self._run(batch)
+                finally:
+                    self._condition.acquire()
+                    self._running = False
+                    self._condition.notify_all()
+            self.latencies.add(time.monotonic() - request.arrival)
+        if request.error is not None:
+            raise request.error
+        return request.output
+
+
 class ModelVLLMBackend(PathFinder):
     def __init__(
         self,
@@ -58,6 +212,14 @@ class ModelVLLMBackend(PathFinder):
         self.temperature = 0.0
         self.top_p = 1.0
         self.max_tokens = 1000
+        self.batcher = None
+
+    def enable_batching(self, max_batch_size=256, max_wait=0.02):
+        """
+        Batch the requests made concurrently from several threads into a single
+        generate call, see `RequestBatcher`.
+        """
+        self.batcher = RequestBatcher(self.model, max_batch_size, max_wait)
 
     def _current_prompt(self):
         if isinstance(self.chat, list):
@@ -88,19 +250,39 @@ class ModelVLLMBackend(PathFinder):
         self.temperature = value.temperature
         self.top_p = value.top_p
         self.max_tokens = value.max_tokens
-        if value.stop_regex is None:
+        stop_pattern = value.stop_pattern()
+        if stop_pattern is None:
             r = r"(.*?)"
         else:
-            r = rf"(.*?)({value.stop_regex})"
+            r = rf"(.*?)({stop_pattern})"
+
+        stop = None
+        if self.text_to_consume == "" and stop_pattern is not None:
+            stop = literal_alternatives(stop_pattern)
+        if stop is None:
+            return self.run(self, r, value.name, True, value.save_stop_text)
 
-        return self.run(self, r, value.name, True, value.save_stop_text)
+        # vLLM stops at the stop strings, the text after them is generated on
+        # demand by the next gen/find/select
+        text = self.request(stop=stop)
+        if text == "":
+            return ""  # the answer ended before any text
+        self.text_to_consume = text
+        res = self.run(self, r, value.name, True, value.save_stop_text)
+        self.text_to_consume = ""
+        return res
 
     def _get_find(self, value: Find):
         self.temperature = value.temperature
         self.top_p = value.top_p
-        return self.run_find(self, value.regex, value.name)
+        return self.run_find(self, value.regex, value.name, value.constrained)
 
     def _get_select(self, value: Select):
+        if value.scoring == "loglik":
+            raise NotImplementedError(
+                "Log-likelihood select scoring is only supported by the transformers"
+                " backend"
+            )
         if all(can_be_int(x) for x in value.options):
             r = r"(\d+)"
         else:
@@ -109,9 +291,11 @@ class ModelVLLMBackend(PathFinder):
             r += r")"
         return self.run(self, r, value.name, False, False)
 
-    def run_find(self, lm, r, name):
+    def run_find(self, lm, r, name, constrained=False):
         if lm.text_to_consume == "":
-            lm.text_to_consume = lm.request()
+            lm.text_to_consume = lm.request(
+                guided_regex=constrained_find_pattern(r) if constrained else None
+            )
         original_res = lm.text_to_consume
         match = regex.search(r, lm.text_to_consume)
         if match:
@@ -173,13 +357,20 @@ class ModelVLLMBackend(PathFinder):
         ).input_ids.tolist()
         return prompt_render, input_ids
 
-    def request(self):
+    def request(self, guided_regex=None, stop=None):
         prompt_render, input_ids = self._format_prompt()
+        kwargs = {} if guided_regex is None else guided_regex_params(guided_regex)
+        if stop is not None:
+            # the stop string is kept, `run` handles it like in a full completion
+            kwargs.update(stop=stop, include_stop_str_in_output=True)
         sampling_params = SamplingParams(
             temperature=self.temperature,
             top_p=self.top_p,
             max_tokens=self.max_tokens,
+            **kwargs,
         )
+        if self.batcher is not None:
+            return self.batcher.generate(input_ids[0], sampling_params)
         output = self.model.generate(
             prompt_token_ids=input_ids,
             sampling_params=sampling_params,
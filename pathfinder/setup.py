@@ -20,7 +20,6 @@ setup(
         "hf_transfer",  # fast transfer of models
         # vllm
         # APIs
-        "backoff",
         "openai",
         "mistralai",
         "anthropic",
@@ -28,6 +27,7 @@ setup(
         "pygtrie",
         "numpy",
     ],
+    entry_points={"console_scripts": ["pathfinder=pathfinder.server:main"]},
     url="https://github.com/giorgiopiatti/pathfinder",
     author="Giorgio Piatti",
 )
@@ -1,6 +1,14 @@
 import pytest
+import torch
 from pathfinder.pathfinder import LlamaChat, PathFinderModel
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    GPT2Config,
+    GPT2LMHeadModel,
+    PreTrainedTokenizerFast,
+)
 
 
 def pytest_addoption(parser):
@@ -40,3 +48,33 @@ def base_tokenizer(arg_LLM):
 @pytest.fixture()
 def llm(base_llm, base_tokenizer):
     return LlamaChat(base_llm, base_tokenizer)
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tiny_gpt2")
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=300,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        special_tokens=["</s>"],
+    )
+    tokenizer.train_from_iterator(["How many tons of fish would you catch?"], trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="</s>")
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tokenizer),
+        n_layer=2,
+        n_head=2,
+        n_embd=16,
+        bos_token_id=0,
+        eos_token_id=0,
+    )
+    model = GPT2LMHeadModel(config).eval()
+    model.save_pretrained(path)
+    model.generation_config.save_pretrained(path)
+    model.name_or_path = str(path)
+    return model, tokenizer
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pathfinder import assistant, find, gen, user
+from pathfinder.pathfinder.api import OpenAICompatibleAPI
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint echoing the last message."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            rate_limited = server.num_rate_limited > 0
+            server.num_rate_limited -= 1
+        if rate_limited:
+            error = json.dumps({"error": {"message": "rate limited"}}).encode()
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(error)))
+            self.send_header("Retry-After", "0.2")
+            self.end_headers()
+            self.wfile.write(error)
+            return
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+            server.num_requests += 1
+            server.bodies.append(body)
+
+        content = server.content or f"echo: {body['messages'][-1]['content']}"
+        response = json.dumps(
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "system_fingerprint": "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.num_requests = 0
+    server.delay = 0.0
+    server.num_rate_limited = 0
+    server.bodies = []
+    server.content = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def stub_api(stub_server, monkeypatch):
+    monkeypatch.setenv("STUB_API_KEY", "stub")
+
+    class StubAPI(OpenAICompatibleAPI):
+        provider = f"stub-{stub_server.server_address[1]}"
+        base_url = f"http://127.0.0.1:{stub_server.server_address[1]}/v1"
+        api_key_env = "STUB_API_KEY"
+
+    return StubAPI
+
+
+def test_request_api(stub_api):
+    lm = stub_api("stub-model", seed=42)
+    out = lm.request_api([{"role": "user", "content": "hi"}], 0.0, 1.0, 10)
+    assert out == "echo: hi"
+
+
+def test_shared_client(stub_api):
+    assert stub_api("stub-model", seed=0).client is stub_api("other", seed=1).client
+
+
+def test_gen(stub_api):
+    lm = stub_api("stub-model", seed=42)
+    with user():
+        lm += "Say something"
+    with assistant():
+        lm += gen(name="answer", stop_regex=r"\.")
+    assert lm["answer"] == "echo: Say something"
+
+
+def test_arequest_api_concurrency(stub_api, stub_server):
+    stub_server.delay = 0.05
+    lm = stub_api("stub-model", seed=42, max_concurrency=3)
+
+    async def main():
+        return await asyncio.gather(
+            *[
+                lm.arequest_api([{"role": "user", "content": str(i)}], 0.0, 1.0, 10)
+                for i in range(12)
+            ]
+        )
+
+    out = asyncio.run(main())
+    assert out == [f"echo: {i}" for i in range(12)]
+    assert stub_server.num_requests == 12
+    assert 1 < stub_server.max_in_flight <= 3
+
+
+def test_rate_limited_retry(stub_api, stub_server):
+    stub_server.num_rate_limited = 2
+    lm = stub_api("stub-model", seed=42, max_concurrency=4)
+    start = time.monotonic()
+    out = lm.request_api([{"role": "user", "content": "hi"}], 0.0, 1.0, 10)
+    assert out == "echo: hi"
+    # waited for both Retry-After, halved the concurrency twice (4 -> 1) and
+    # grew it back by one with the successful request
+    assert time.monotonic() - start >= 0.4
+    assert lm._limit().limit == 2
+
+
+def test_requests_per_minute(stub_api):
+    lm = stub_api("stub-model", seed=42, requests_per_minute=600)
+    lm._rate_limiter().requests.tokens = 0
+    start = time.monotonic()
+    for _ in range(3):
+        lm.request_api([{"role": "user", "content": "hi"}], 0.0, 1.0, 10)
+    # 10 requests/s once the budget is spent
+    assert time.monotonic() - start >= 0.25
+
+
+def test_gen_stop_then_find(stub_api, stub_server):
+    stub_server.content = "I would catch 5 tons. Answer: 12"
+    lm = stub_api("stub-model", seed=42)
+    with user():
+        lm += "How many tons?"
+    with assistant():
+        lm += gen(name="reasoning", stop_regex=r"Answer:|So, the answer is:")
+        lm += find(regex=r"\d+", name="answer")
+    assert lm["reasoning"] == "I would catch 5 tons. "
+    assert lm["answer"] == "12"
+    # chat completions start a new reply, the find parses the full completion
+    assert stub_server.num_requests == 1
+    assert "stop" not in stub_server.bodies[-1]
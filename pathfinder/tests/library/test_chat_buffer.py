@@ -0,0 +1,41 @@
+from pathfinder import assistant, user
+from pathfinder.pathfinder.backend import PathFinder
+
+
+def test_copies_share_nothing_mutable():
+    lm = PathFinder("test")
+    with user():
+        lm += "Hello"
+    with assistant():
+        lm += "Hi"
+        first = lm + ", Alice"
+        second = lm + ", Bob"
+    assert lm.chat == [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi"},
+    ]
+    assert first.chat[-1]["content"] == "Hi, Alice"
+    assert second.chat[-1]["content"] == "Hi, Bob"
+
+
+def test_chat_built_from_many_fragments():
+    lm = PathFinder("test")
+    with user():
+        for i in range(20000):
+            lm += f"{i} "
+            if i % 1000 == 0:
+                assert lm.chat[-1]["content"].endswith(f" {i} ") or i == 0
+    assert lm.chat[-1]["content"] == "".join(f"{i} " for i in range(20000))
+
+
+def test_chat_assignment():
+    lm = PathFinder("test")
+    lm.chat = [{"role": "user", "content": "Hello"}]
+    with user():
+        lm += "Again"
+    assert [entry["content"] for entry in lm.chat] == ["Hello", "Again"]
+
+    lm = PathFinder("test")
+    lm += "Plain "
+    lm += "prompt"
+    assert lm.chat == "Plain prompt"
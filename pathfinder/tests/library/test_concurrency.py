@@ -0,0 +1,50 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from pathfinder import assistant, system, user
+from pathfinder.pathfinder.backend import PathFinder
+
+NUM_PROMPTS = 2000
+
+
+def build_prompt(i):
+    lm = PathFinder("test")
+    with system():
+        lm += f"You are persona {i}."
+    with user():
+        for j in range(5):
+            lm += f" Memory {j} of persona {i}."
+    with assistant():
+        lm += f"Answer of persona {i}"
+    return lm.chat
+
+
+async def abuild_prompt(i):
+    lm = PathFinder("test")
+    with system():
+        lm += f"You are persona {i}."
+        await asyncio.sleep(0)
+    with user():
+        for j in range(5):
+            lm += f" Memory {j} of persona {i}."
+            await asyncio.sleep(0)  # let the other tasks open their blocks
+    with assistant():
+        await asyncio.sleep(0)
+        lm += f"Answer of persona {i}"
+    return lm.chat
+
+
+def test_prompts_built_in_threads():
+    expected = [build_prompt(i) for i in range(NUM_PROMPTS)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert list(executor.map(build_prompt, range(NUM_PROMPTS))) == expected
+
+
+def test_prompts_built_in_asyncio_tasks():
+    expected = [build_prompt(i) for i in range(NUM_PROMPTS)]
+
+    async def main():
+        return await asyncio.gather(*(abuild_prompt(i) for i in range(NUM_PROMPTS)))
+
+    assert asyncio.run(main()) == expected
+    assert PathFinder.open_block is None
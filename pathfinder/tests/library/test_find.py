@@ -0,0 +1,41 @@
+import random
+
+import regex
+from pathfinder import assistant, find, user
+from pathfinder.pathfinder.fsm import compile_fsm
+from pathfinder.pathfinder.model import Model
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+def test_fsm_matches_regex_prefixes():
+    random.seed(0)
+    for pattern in [r"\d+", r"(yes|no)", r"[A-Z][a-z]{1,3}", r"a.b|x?y*z", r"[^0-9]+"]:
+        fsm = compile_fsm(pattern)
+        compiled = regex.compile(pattern)
+        for _ in range(500):
+            text = "".join(
+                random.choice("abxyz Nyesno019\n") for _ in range(random.randint(0, 6))
+            )
+            state = fsm.walk(fsm.initial, text)
+            assert bool(state) == bool(compiled.fullmatch(text, partial=True))
+            assert (bool(state) and fsm.is_accepting(state)) == bool(
+                compiled.fullmatch(text)
+            )
+
+
+def test_find_constrained(tiny_model):
+    model, tokenizer = tiny_model
+    for pattern in [r"\d+", r"(yes|no)"]:
+        lm = Model(model, tokenizer, template=TEMPLATE)
+        with user():
+            lm += "How many tons of fish would you catch?"
+        with assistant():
+            lm += "Answer:"
+            lm += find(regex=pattern, max_tokens=20, name="answer", constrained=True)
+        generated = lm.chat[-1]["content"][len("Answer:") :]
+        assert regex.fullmatch(rf"\s{{0,4}}{pattern}", generated)
+        assert regex.fullmatch(pattern, lm["answer"])
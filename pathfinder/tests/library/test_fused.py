@@ -0,0 +1,61 @@
+import regex
+from pathfinder import assistant, find, gen, select, user
+from pathfinder.pathfinder.model import Model
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+def count_generate_calls(model):
+    calls = []
+    generate = model.generate
+
+    def counting_generate(*args, **kwargs):
+        calls.append(1)
+        return generate(*args, **kwargs)
+
+    model.generate = counting_generate
+    return calls
+
+
+def new_lm(model, tokenizer):
+    lm = Model(model, tokenizer, template=TEMPLATE)
+    with user():
+        lm += "How many tons of fish would you catch? " * 2
+    return lm
+
+
+def test_fused_fields_consume_one_generation(tiny_model):
+    model, tokenizer = tiny_model
+    lm = new_lm(model, tokenizer)
+    with assistant():
+        lm += gen(max_tokens=30, name="all")
+    text = lm["all"]
+    stop = text[10:13]
+
+    calls = count_generate_calls(model)
+    try:
+        lm = new_lm(model, tokenizer)
+        lm.enable_fused(max_tokens=30)
+        with assistant():
+            lm += gen(stop_regex=regex.escape(stop), name="first")
+            lm += stop
+            lm += gen(name="second")
+    finally:
+        del model.generate
+    assert lm["first"] + stop + lm["second"] == text
+    assert len(calls) == 1
+
+
+def test_fused_falls_back_when_parsing_fails(tiny_model):
+    model, tokenizer = tiny_model
+    lm = new_lm(model, tokenizer)
+    lm.enable_fused(max_tokens=30)
+    with assistant():
+        lm += gen(max_tokens=30, stop_regex=r"fish", name="reasoning")
+        lm += select(["fish", "tons"], name="unit")
+        lm += find(regex=r"\d+", constrained=True, max_tokens=5, name="number")
+    assert lm["unit"] in ["fish", "tons"]
+    assert regex.fullmatch(r"\d+", lm["number"])
@@ -0,0 +1,73 @@
+from pathfinder import assistant, gen, select, user
+from pathfinder.pathfinder.model import GenerationSession, Model
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+def run_chain(model, tokenizer, reuse_kv_cache):
+    lm = Model(
+        model,
+        tokenizer,
+        template=TEMPLATE,
+        session=GenerationSession(model, tokenizer, reuse_kv_cache=reuse_kv_cache),
+    )
+    with user():
+        lm += "How many tons of fish would you catch? " * 5
+    with assistant():
+        lm += gen(max_tokens=30, stop_regex=r"fish", name="reasoning")
+        lm += " so "
+        lm += select(["fish", "tons", "catch"], name="first")
+        lm += " and "
+        lm += select(["How", "would"], name="second")
+    return lm["reasoning"], lm["first"], lm["second"]
+
+
+def test_kv_cache_reuse_same_outputs(tiny_model):
+    model, tokenizer = tiny_model
+    assert run_chain(model, tokenizer, False) == run_chain(model, tokenizer, True)
+
+
+def test_radix_cache_shares_prefix_across_copies(tiny_model):
+    model, tokenizer = tiny_model
+    session = GenerationSession(model, tokenizer)
+    lm = Model(model, tokenizer, template=TEMPLATE, session=session)
+    with user():
+        lm += "How many tons of fish would you catch? " * 5
+
+    outputs = []
+    for question in ["fish?", "tons?"]:
+        persona = lm
+        with user():
+            persona += question
+        with assistant():
+            persona += gen(max_tokens=10, stop_regex=r"\n", name="answer")
+        outputs.append(persona["answer"])
+
+    stats = session.kv_cache.stats()
+    assert stats["hits"] == 1 and stats["lookups"] == 2
+    assert 0 < stats["num_bytes"] <= stats["max_bytes"]
+
+    uncached = GenerationSession(model, tokenizer, reuse_kv_cache=False)
+    lm = Model(model, tokenizer, template=TEMPLATE, session=uncached)
+    with user():
+        lm += "How many tons of fish would you catch? " * 5
+    with user():
+        lm += "tons?"
+    with assistant():
+        lm += gen(max_tokens=10, stop_regex=r"\n", name="answer")
+    assert lm["answer"] == outputs[1]
+
+
+def test_radix_cache_evicts_to_byte_cap(tiny_model):
+    model, tokenizer = tiny_model
+    session = GenerationSession(model, tokenizer, kv_cache_bytes=20_000)
+    for question in ["fish?", "tons?", "catch?", "How?"]:
+        lm = Model(model, tokenizer, template=TEMPLATE, session=session)
+        with user():
+            lm += "How many tons of fish would you catch? " * 3 + question
+        with assistant():
+            lm += gen(max_tokens=10, stop_regex=r"\n", name="answer")
+        assert session.kv_cache.num_bytes <= 20_000
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+from pathfinder.pathfinder import loader
+from pathfinder.pathfinder.model import GenerationSession, Model
+
+
+def test_get_model_loads_once(tiny_model, monkeypatch):
+    model, tokenizer = tiny_model
+    loads = []
+
+    def load_model(name, seed, backend_name, gpu_list, kv_cache_bytes):
+        loads.append(name)
+        session = GenerationSession(
+            model, tokenizer, False, kv_cache_bytes > 0, kv_cache_bytes
+        )
+        return Model(model, tokenizer, session=session)
+
+    monkeypatch.setattr(loader, "_registry", {})
+    monkeypatch.setattr(loader, "_load_model", load_model)
+    a = loader.get_model("llama-3-tiny", seed=1, kv_cache_bytes=1 << 20)
+    b = loader.get_model("llama-3-tiny", seed=2)
+    c = loader.get_model("llama-3-tiny", backend_name="vllm", kv_cache_bytes=0)
+    assert a is b and a is not c
+    assert loads == ["llama-3-tiny", "llama-3-tiny"]
+    assert a.session.kv_cache.max_bytes == 1 << 20
+    assert c.session.kv_cache is None
+
+    report = loader.loaded_models()
+    assert [(entry["name"], entry["backend"]) for entry in report] == [
+        ("llama-3-tiny", "transformers"),
+        ("llama-3-tiny", "vllm"),
+    ]
+    weights_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    assert report[0]["weights_bytes"] >= weights_bytes
+    assert report[0]["kv_cache_bytes"] == 0
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, pathfinder\n"
+        "from pathfinder import assistant, gen, get_model, system, user\n"
+        "assert 'torch' not in sys.modules and 'transformers' not in sys.modules\n"
+        "pathfinder.PathFinderModel\n"
+        "assert 'torch' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from pathfinder import assistant, find, gen, select, user
+from pathfinder.pathfinder import loader
+from pathfinder.pathfinder.model import GenerationSession, Model
+from pathfinder.pathfinder.remote import ModelRemote, RemoteError
+from pathfinder.pathfinder.server import ModelServer
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+@pytest.fixture()
+def server(tiny_model, tmp_path, monkeypatch):
+    model, tokenizer = tiny_model
+    loads = []
+
+    def load_model(name, seed, backend_name, gpu_list, kv_cache_bytes):
+        loads.append(name)
+        session = GenerationSession(model, tokenizer, False)
+        return Model(model, tokenizer, template=TEMPLATE, session=session)
+
+    monkeypatch.setattr(loader, "_registry", {})
+    monkeypatch.setattr(loader, "_load_model", load_model)
+    server = ModelServer(str(tmp_path / "pathfinder.sock"))
+    server.loads = loads
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def chain(lm):
+    with user():
+        lm += "How many tons of fish would you catch?"
+    with assistant():
+        lm += gen(max_tokens=5, name="reasoning")
+        lm += "Answer:"
+        lm += find(regex=r"\d+", max_tokens=5, name="answer", constrained=True)
+        lm += select(["yes", "no"], name="sure", scoring="loglik")
+    return lm
+
+
+def test_remote_matches_local(server):
+    remote = chain(ModelRemote("llama-3-tiny", address=server.server_address))
+    local = chain(loader.get_model("llama-3-tiny"))
+    assert remote.chat == local.chat
+    for name in ["reasoning", "answer", "sure", "sure_logprobs"]:
+        assert remote[name] == pytest.approx(local[name])
+    assert server.loads == ["llama-3-tiny"]
+
+
+def test_remote_error(server):
+    lm = ModelRemote("llama-3-tiny", address=server.server_address)
+    with user():
+        lm += "How many tons of fish would you catch?"
+    with pytest.raises(RemoteError):
+        with assistant():
+            lm += select([], name="empty")
@@ -1,4 +1,7 @@
+import pytest
+import torch
 from pathfinder import PathFinderModel, assistant, gen, select, user
+from pathfinder.pathfinder.model import Model
 
 
 def test_select_tags(llm):
@@ -9,3 +12,65 @@ def test_select_tags(llm):
         lm += "I like "
         lm += select(["apples", "oranges"], name="fruit")
     assert lm["fruit"] == "apples" or lm["fruit"] == "oranges"
+
+
+TEMPLATE = (
+    "{% for m in messages %}{{m['role']}}: {{m['content']}}\n{% endfor %}"
+    "{% if add_generation_prompt %}assistant:{% endif %}"
+)
+
+
+def test_select_rating_forward_passes(tiny_model):
+    model, tokenizer = tiny_model
+    forward_calls = []
+    handle = model.register_forward_hook(lambda *args: forward_calls.append(1))
+    try:
+        lm = Model(model, tokenizer, template=TEMPLATE)
+        with user():
+            lm += "How many tons of fish would you catch? Rate from 1 to 10."
+        with assistant():
+            lm += "Rating: "
+            lm += select([str(i) for i in range(1, 11)], name="rating")
+    finally:
+        handle.remove()
+    assert lm["rating"] in [str(i) for i in range(1, 11)]
+    assert len(forward_calls) <= 2
+
+
+def test_select_option_merging_with_prompt(tiny_model):
+    model, tokenizer = tiny_model
+    lm = Model(model, tokenizer, template=TEMPLATE)
+    with user():
+        lm += "How many tons of fish would you catch?"
+    with assistant():
+        lm += "I would catch"
+        lm += select([" many tons", " fish"], name="answer")
+    assert lm["answer"] in [" many tons", " fish"]
+    assert lm.chat[-1]["content"] == "I would catch" + lm["answer"]
+
+
+def test_select_loglik_scores(tiny_model):
+    model, tokenizer = tiny_model
+    options = ["fish", "many tons", "1", "10"]
+    lm = Model(model, tokenizer, template=TEMPLATE)
+    with user():
+        lm += "How many tons of fish would you catch?"
+    with assistant():
+        lm += "I would catch "
+        prompt_render = lm._render_prompt()
+        lm += select(options, name="answer", scoring="loglik")
+
+    logprobs = lm["answer_logprobs"]
+    assert lm["answer"] == max(options, key=logprobs.get)
+
+    # same as scoring each prompt + option on its own
+    prompt_ids, options_ids = lm._tokenize_options(prompt_render, options)
+    for option, option_ids in zip(options, options_ids):
+        with torch.no_grad():
+            logits = model(torch.tensor([prompt_ids + option_ids])).logits[0]
+        token_logprobs = torch.log_softmax(logits, dim=-1)
+        expected = sum(
+            float(token_logprobs[len(prompt_ids) - 1 + i, token])
+            for i, token in enumerate(option_ids)
+        )
+        assert logprobs[option] == pytest.approx(expected, abs=1e-4)
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+import regex
+import torch
+from pathfinder.pathfinder.model import RegexStoppingCriteria
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+CORPUS = [
+    "Answer: 10 tons. So, the answer is: 5",
+    "1) apples 2) oranges 3) pears 4) plums",
+    "Il était une fois, à côté du lac… 🐟 日本語のテキスト",
+    "Utterance: Hello everyone!\nNEXT: John\n\nEND",
+]
+
+
+def train_tokenizer(kind):
+    if kind == "byte_level":
+        tokenizer = Tokenizer(models.BPE())
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        alphabet = pre_tokenizers.ByteLevel.alphabet()
+    else:
+        tokenizer = Tokenizer(models.BPE(byte_fallback=True))
+        tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+        tokenizer.decoder = decoders.Sequence(
+            [decoders.ByteFallback(), decoders.Metaspace()]
+        )
+        alphabet = [f"<0x{i:02X}>" for i in range(256)]
+    trainer = trainers.BpeTrainer(
+        vocab_size=300, initial_alphabet=alphabet, special_tokens=["</s>"]
+    )
+    tokenizer.train_from_iterator(CORPUS * 10, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="</s>")
+
+
+def full_decode_stop_step(tokenizer, prompt, generated, stop_regex):
+    """Stopping step of the reference implementation, decoding everything."""
+    patterns = [regex.compile(p) for p in stop_regex]
+    for step in range(1, len(generated) + 1):
+        text = tokenizer.decode(generated[:step], skip_special_tokens=False)
+        if any(p.search(text) for p in patterns):
+            return step
+    return None
+
+
+@pytest.mark.parametrize("kind", ["byte_level", "metaspace"])
+@pytest.mark.parametrize(
+    "stop_regex", [[r"Answer:|So, the answer is:"], [r"4\)"], [r"\n\n.*END"], [r"é"]]
+)
+def test_stop_step_matches_full_decode(kind, stop_regex):
+    tokenizer = train_tokenizer(kind)
+    rng = random.Random(0)
+    prompt = tokenizer.encode("Question: ")
+    for _ in range(20):
+        text = " ".join(rng.choice(CORPUS) for _ in range(4))
+        generated = tokenizer.encode(text, add_special_tokens=False)
+        expected = full_decode_stop_step(tokenizer, prompt, generated, stop_regex)
+
+        criteria = RegexStoppingCriteria(stop_regex, tokenizer.decode, len(prompt))
+        step = None
+        for i in range(1, len(generated) + 1):
+            input_ids = torch.tensor([prompt + generated[:i]])
+            if criteria(input_ids, None):
+                step = i
+                break
+        assert step == expected
@@ -7,33 +7,74 @@ import numpy as np
 from hydra import compose, initialize
 from hydra.core.global_hydra import GlobalHydra
 from omegaconf import DictConfig, OmegaConf
-from transformers import set_seed
 
 import wandb
-from pathfinder import get_model
-from simulation.utils import ModelWandbWrapper, WandbLogger
+from pathfinder import get_model, loaded_models
+from simulation.utils import ModelWandbWrapper, ResponseCache, WandbLogger
 
 from .persona import EmbeddingModel
-from .scenarios.fishing.run import run as run_scenario_fishing
-from .scenarios.pollution.run import run as run_scenario_pollution
-from .scenarios.sheep.run import run as run_scenario_sheep
 
 from dotenv import load_dotenv
 load_dotenv()
 
+def load_model(llm_cfg, seed, num_workers, gpu_list=None):
+    """
+    The model of an `llm` config, with its fused mode enabled if configured. With
+    several workers, a local vLLM model batches the concurrent requests of the
+    personas (and framework) sharing it.
+    """
+    fused = llm_cfg.get("fused", False)
+    if fused and (llm_cfg.is_api or llm_cfg.backend != "transformers"):
+        raise ValueError(
+            f"llm.fused is only supported by the transformers backend, not by"
+            f" {'an API model' if llm_cfg.is_api else llm_cfg.backend} ({llm_cfg.path})"
+        )
+    model = get_model(
+        llm_cfg.path,
+        llm_cfg.is_api,
+        seed,
+        llm_cfg.backend,
+        gpu_list,
+        kv_cache_bytes=llm_cfg.get("kv_cache_bytes"),
+    )
+    if fused:
+        model.enable_fused()
+    if (
+        num_workers > 1
+        and llm_cfg.backend == "vllm"
+        and not llm_cfg.is_api
+        and model.batcher is None  # the model is shared by the configs using it
+    ):
+        model.enable_batching()
+    return model
+
+
 @hydra.main(version_base=None, config_path="conf", config_name="config")
 def main(cfg: DictConfig):
     print(OmegaConf.to_yaml(cfg))
+    # torch, transformers and the scenarios are imported once the run starts
+    from transformers import set_seed
+
     set_seed(cfg.seed)
 
     logger = WandbLogger(cfg.experiment.name, OmegaConf.to_object(cfg), debug=cfg.debug)
+    resume = cfg.resume_from is not None
     experiment_storage = os.path.join(
         os.path.dirname(__file__),
-        f"./results/{cfg.experiment.name}/{logger.run_name}",
+        f"./results/{cfg.experiment.name}/"
+        f"{cfg.resume_from if resume else logger.run_name}",
+    )
+    if resume and not os.path.isdir(experiment_storage):
+        raise ValueError(f"Cannot resume, {experiment_storage} does not exist")
+
+    response_cache = ResponseCache(
+        cfg.response_cache.path
+        or os.path.join(os.path.dirname(__file__), "./.cache/responses.sqlite"),
+        mode=cfg.response_cache.mode,
     )
 
     if len(cfg.mix_llm) == 0:
-        model = get_model(cfg.llm.path, cfg.llm.is_api, cfg.seed, cfg.llm.backend)
+        model = load_model(cfg.llm, cfg.seed, cfg.num_workers)
 
         wrapper = ModelWandbWrapper(
             model,
@@ -43,6 +84,8 @@ def main(cfg: DictConfig):
             top_p=cfg.llm.top_p,
             seed=cfg.seed,
             is_api=cfg.llm.is_api,
+            response_cache=response_cache,
+            constrained_find=cfg.llm.get("constrained_find", False),
         )
         wrappers = [wrapper] * cfg.experiment.personas.num
         wrapper_framework = wrapper
@@ -63,16 +106,12 @@ def main(cfg: DictConfig):
                 llm_config.temperature,
                 llm_config.top_p,
                 llm_config.gpu_list,
+                llm_config.get("constrained_find", False),
             )
             if config_key not in unique_configs:
-                # Initialize the model only if its config is not already in the unique set
-                model = get_model(
-                    llm_config.path,
-                    llm_config.is_api,
-                    cfg.seed,
-                    llm_config.backend,
-                    # llm_config.gpu_list,
-                )
+                # One wrapper per sampling config, the weights of a model are
+                # loaded once and shared by its wrappers
+                model = load_model(llm_config, cfg.seed, cfg.num_workers)
                 wrapper = ModelWandbWrapper(
                     model,
                     render=llm_config.render,
@@ -81,6 +120,8 @@ def main(cfg: DictConfig):
                     top_p=llm_config.top_p,
                     seed=cfg.seed,
                     is_api=llm_config.is_api,
+                    response_cache=response_cache,
+                    constrained_find=llm_config.get("constrained_find", False),
                 )
                 unique_configs[config_key] = wrapper
 
@@ -96,13 +137,13 @@ def main(cfg: DictConfig):
             llm_framework_config.temperature,
             llm_framework_config.top_p,
             llm_framework_config.gpu_list,
+            llm_framework_config.get("constrained_find", False),
         )
         if config_key not in unique_configs:
-            model = get_model(
-                llm_framework_config.path,
-                llm_framework_config.is_api,
+            model = load_model(
+                llm_framework_config,
                 cfg.seed,
-                llm_framework_config.backend,
+                cfg.num_workers,
                 llm_framework_config.gpu_list,
             )
             wrapper_framework = ModelWandbWrapper(
@@ -113,14 +154,31 @@ def main(cfg: DictConfig):
                 top_p=llm_framework_config.top_p,
                 seed=cfg.seed,
                 is_api=llm_framework_config.is_api,
+                response_cache=response_cache,
+                constrained_find=llm_framework_config.get("constrained_find", False),
             )
             unique_configs[config_key] = wrapper_framework
         else:
             wrapper_framework = unique_configs[config_key]
 
-    embedding_model = EmbeddingModel(device="cpu")
+    for entry in loaded_models():
+        print(f"Loaded model: {entry}")
+
+    embedding_model = EmbeddingModel(
+        device="cpu",
+        cache_path=(
+            (
+                cfg.embedding_cache.path
+                or os.path.join(os.path.dirname(__file__), "./.cache/embeddings.sqlite")
+            )
+            if cfg.embedding_cache.enabled
+            else None
+        ),
+    )
 
     if cfg.experiment.scenario == "fishing":
+        from .scenarios.fishing.run import run as run_scenario_fishing
+
         run_scenario_fishing(
             cfg.experiment,
             logger,
@@ -128,8 +186,12 @@ def main(cfg: DictConfig):
             wrapper_framework,
             embedding_model,
             experiment_storage,
+            resume=resume,
+            num_workers=cfg.num_workers,
         )
     elif cfg.experiment.scenario == "sheep":
+        from .scenarios.sheep.run import run as run_scenario_sheep
+
         run_scenario_sheep(
             cfg.experiment,
             logger,
@@ -137,8 +199,12 @@ def main(cfg: DictConfig):
             wrapper_framework,
             embedding_model,
             experiment_storage,
+            resume=resume,
+            num_workers=cfg.num_workers,
         )
     elif cfg.experiment.scenario == "pollution":
+        from .scenarios.pollution.run import run as run_scenario_pollution
+
         run_scenario_pollution(
             cfg.experiment,
             logger,
@@ -146,12 +212,26 @@ def main(cfg: DictConfig):
             wrapper_framework,
             embedding_model,
             experiment_storage,
+            resume=resume,
+            num_workers=cfg.num_workers,
         )
     else:
         raise ValueError(f"Unknown experiment.scenario: {cfg.experiment.scenario}")
 
+    print(f"Embedding cache: {embedding_model.cache_stats()}")
+    models = {id(w.base_lm): w.base_lm for w in [*wrappers, wrapper_framework]}
+    for model in models.values():
+        if getattr(model, "batcher", None) is not None:
+            print(f"Request batching ({model.model_name}): {model.batcher.stats()}")
+    if response_cache.enabled:
+        print(f"Response cache: {response_cache.stats()}")
+    response_cache.close()
+    embedding_model.close()
+
     hydra_log_path = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir
-    shutil.copytree(f"{hydra_log_path}/.hydra/", f"{experiment_storage}/.hydra/")
+    shutil.copytree(
+        f"{hydra_log_path}/.hydra/", f"{experiment_storage}/.hydra/", dirs_exist_ok=True
+    )
     shutil.copy(f"{hydra_log_path}/main.log", f"{experiment_storage}/main.log")
     # shutil.rmtree(hydra_log_path)
 
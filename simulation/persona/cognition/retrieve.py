@@ -49,68 +49,73 @@ class RetrieveComponent(Component):
         }
         self.recency_decay_param = 0.99
 
-    def _recency_retrieval(self, nodes: list[Node]) -> dict[str, float]:
+    def _recency_retrieval(self, num_nodes: int) -> np.ndarray:
         """
-        Calculate the recency retrieval scores for a list of nodes.
+        Calculate the recency retrieval scores for the nodes eligible for retrieval.
 
         Args:
-            nodes (list[Node]): The list of nodes to calculate recency retrieval scores for.
+            num_nodes (int): The number of nodes, in insertion order.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their recency retrieval scores.
+            np.ndarray: The recency retrieval score of each node.
         """
-        result = dict()
-        for i, node in enumerate(nodes):
-            result[node.id] = self.recency_decay_param**i
-        return result
+        return self.recency_decay_param ** np.arange(num_nodes, dtype=np.float64)
 
-    def _importance_retrieval(self, nodes: list[Node]) -> dict[str, float]:
+    def _importance_retrieval(self, importance_scores: np.ndarray) -> np.ndarray:
         """
-        Retrieve the importance scores for a list of nodes and normalize them.
+        Normalize the importance scores of the nodes eligible for retrieval.
 
         Args:
-            nodes (list[Node]): The list of nodes to retrieve importance scores for.
+            importance_scores (np.ndarray): The raw importance score of each node.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their normalized importance scores.
+            np.ndarray: The normalized importance score of each node.
         """
-        result = dict()
-        for node in nodes:
-            result[node.id] = node.importance_score
-
-        # normalize
         min_score = 1
         max_score = 10
-        for node_id in result.keys():
-            result[node_id] = (result[node_id] - min_score) / (max_score - min_score)
-
-        return result
+        return (importance_scores.astype(np.float64) - min_score) / (
+            max_score - min_score
+        )
 
     def _relevance_retrieval(
-        self, nodes: list[Node], focal_point: str
-    ) -> dict[str, float]:
+        self, embeddings: np.ndarray, focal_points: list[str]
+    ) -> np.ndarray:
         """
-        Retrieves the relevance scores of nodes based on their similarity to the focal point.
+        Retrieves the relevance scores of nodes based on their similarity to the focal points.
 
         Args:
-            nodes (list[Node]): The list of nodes to retrieve relevance scores for.
-            focal_point (str): The focal point used for comparison.
+            embeddings (np.ndarray): The normalized node embeddings, one row per node.
+            focal_points (list[str]): The focal points used for comparison.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their relevance scores.
+            np.ndarray: The cosine similarity of each focal point (rows) to each node (columns).
         """
-
-        result = dict()
-        focal_point_embedding = self.embedding_model.embed_retrieve(focal_point)
-
-        def cosine_similarity(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-        for node in nodes:
-            node_embedding = self.associative_memory.get_node_embedding(node.id)
-            result[node.id] = cosine_similarity(focal_point_embedding, node_embedding)
-
-        return result
+        focal_point_embeddings = self.embedding_model.embed_retrieve_many(
+            focal_points
+        ).astype(np.float32)
+        norms = np.linalg.norm(focal_point_embeddings, axis=1, keepdims=True)
+        focal_point_embeddings /= np.where(norms > 0, norms, 1.0)
+
+        if embeddings.shape[0] == 0:
+            return np.zeros((len(focal_points), 0), dtype=np.float64)
+        return (focal_point_embeddings @ embeddings.T).astype(np.float64)
+
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k highest scores, highest first. Ties are broken by the
+        lower index, which matches a stable descending sort.
+        """
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if top_k < len(scores):
+            partition = np.argpartition(-scores, top_k - 1)[:top_k]
+            threshold = scores[partition].min()
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            candidates = np.arange(len(scores))
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order][:top_k]
 
     def _retrieve_dict(
         self, focal_points: list[str], top_k: int
@@ -126,42 +131,33 @@ class RetrieveComponent(Component):
             dict[str, list[Node]]: Dictionary mapping each focal point to a list of top-k nodes.
 
         """
-        nodes = self.associative_memory.get_nodes_for_retrieval(
-            self.persona.current_time
+        nodes, embeddings, importance_scores, always_include = (
+            self.associative_memory.get_retrieval_arrays(self.persona.current_time)
+        )
+        focal_points = list(dict.fromkeys(focal_points))  # embed each once
+        if len(focal_points) == 0:
+            return dict()
+        if len(nodes) == 0:
+            return {focal_point: [] for focal_point in focal_points}
+
+        base_scores = (
+            self._recency_retrieval(len(nodes)) * self.weights["recency"]
+            + self._importance_retrieval(importance_scores) * self.weights["importance"]
+        )
+        combined_scores = (
+            base_scores[None, :]
+            + self._relevance_retrieval(embeddings, focal_points)
+            * self.weights["relevance"]
         )
-
-        recency_scores = self._recency_retrieval(nodes)
-        importance_scores = self._importance_retrieval(nodes)
 
         acc_nodes = dict()
-
-        for focal_point in focal_points:
-            relevance_scores = self._relevance_retrieval(nodes, focal_point)
-
-            # combine scores
-            combined_scores = dict()
-
-            for node_id in recency_scores.keys():
-                combined_scores[node_id] = (
-                    recency_scores[node_id] * self.weights["recency"]
-                    + importance_scores[node_id] * self.weights["importance"]
-                    + relevance_scores[node_id] * self.weights["relevance"]
-                )
-
+        for focal_point, scores in zip(focal_points, combined_scores):
             # Put max score to node with always_include flag
-            max_value = max(combined_scores.values()) if combined_scores else 10
-            for node in nodes:
-                if node.always_include:
-                    combined_scores[node.id] = max_value + 1
-
-            # sort by combined scores
-            sorted_nodes = sorted(
-                nodes, key=lambda node: combined_scores[node.id], reverse=True
-            )
-
-            # pick top k
-            top_k_nodes = sorted_nodes[:top_k]
-            acc_nodes[focal_point] = top_k_nodes
+            scores[always_include] = scores.max() + 1
+
+            acc_nodes[focal_point] = [
+                nodes[i] for i in self._top_k_indices(scores, top_k)
+            ]
         return acc_nodes
 
     def retrieve(
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings.
+
+    Vectors are keyed by a hash of (model id, prefix, text). Recently used vectors
+    are kept in an in-memory LRU, and, if a path is given, every vector is also
+    persisted in a sqlite database so that later runs can reuse it.
+    """
+
+    def __init__(self, path: str = None, max_size: int = 10000) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.lru: OrderedDict[str, np.ndarray] = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings"
+                " (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def key(model_id: str, prefix: str, text: str) -> str:
+        h = hashlib.sha256()
+        for part in (model_id, prefix, text):
+            data = part.encode("utf-8")
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self.lru[key] = vec
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    def get(self, key: str) -> np.ndarray:
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return self.lru[key]
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT vec FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vec)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vec
+            self.misses += 1
+            return None
+
+    def put_many(self, items: list[tuple[str, np.ndarray]]):
+        with self.lock:
+            rows = []
+            for key, vec in items:
+                vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+                vec.flags.writeable = False  # shared between callers
+                self._remember(key, vec)
+                rows.append((key, vec.tobytes()))
+            if self.db is not None and len(rows) > 0:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", rows
+                )
+                self.db.commit()
+
+    def put(self, key: str, vec: np.ndarray):
+        self.put_many([(key, vec)])
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "memory_size": len(self.lru),
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -1,22 +1,78 @@
 import numpy as np
 
-# Implemented using this: https://huggingface.co/mixedbread-ai/mxbai-embed-large-v1
-from sentence_transformers import SentenceTransformer
+from .embedding_cache import EmbeddingCache
+
+MODEL_ID = "mixedbread-ai/mxbai-embed-large-v1"
+RETRIEVE_PREFIX = "Represent this sentence for searching relevant passages: "
 
 
 class EmbeddingModel:
-    def __init__(self, device) -> None:
-        self.model = SentenceTransformer(
-            "mixedbread-ai/mxbai-embed-large-v1", device=device
-        )
+    def __init__(
+        self,
+        device,
+        batch_size: int = 32,
+        cache_path: str = None,
+        cache_size: int = 10000,
+    ) -> None:
+        # Implemented using this: https://huggingface.co/mixedbread-ai/mxbai-embed-large-v1
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(MODEL_ID, device=device)
+        self.model_id = MODEL_ID
 
         self.device = device
+        self.batch_size = batch_size
+        self.cache = EmbeddingCache(cache_path, max_size=cache_size)
+
+    def _embed_cached(self, prefix: str, texts: list[str]) -> np.ndarray:
+        keys = [EmbeddingCache.key(self.model_id, prefix, text) for text in texts]
+        vecs = [self.cache.get(key) for key in keys]
+
+        missing = {}  # key -> text, each distinct text is encoded once
+        for key, text, vec in zip(keys, texts, vecs):
+            if vec is None:
+                missing[key] = text
+        if len(missing) > 0:
+            encoded = self.model.encode(
+                [f"{prefix}{text}" for text in missing.values()],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            self.cache.put_many(list(zip(missing.keys(), encoded)))
+            new_vecs = dict(zip(missing.keys(), encoded))
+            vecs = [
+                vec if vec is not None else new_vecs[key]
+                for key, vec in zip(keys, vecs)
+            ]
+
+        if len(vecs) == 0:
+            return np.zeros(
+                (0, self.model.get_sentence_embedding_dimension()), dtype=np.float32
+            )
+        return np.stack(vecs)
 
     def embed(self, text: str) -> np.ndarray:
-        vec = self.model.encode(text, convert_to_numpy=True, show_progress_bar=False)
-        return vec.squeeze()
+        return self._embed_cached("", [text])[0]
 
     def embed_retrieve(self, text: str) -> np.ndarray:
-        return self.embed(
-            f"Represent this sentence for searching relevant passages: {text}"
-        )
+        return self._embed_cached(RETRIEVE_PREFIX, [text])[0]
+
+    def embed_many(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed several texts in a single forward pass, skipping cached ones.
+
+        Returns:
+            np.ndarray: One embedding per row, in the order of `texts`.
+        """
+        return self._embed_cached("", list(texts))
+
+    def embed_retrieve_many(self, texts: list[str]) -> np.ndarray:
+        return self._embed_cached(RETRIEVE_PREFIX, list(texts))
+
+    def cache_stats(self) -> dict[str, float]:
+        return self.cache.stats()
+
+    def close(self):
+        """Closes the persistent cache, if any."""
+        self.cache.close()
@@ -1,4 +1,3 @@
-import json
 import os
 import typing
 from datetime import datetime
@@ -6,6 +5,8 @@ from enum import Enum
 
 import numpy as np
 
+from .snapshot import META_FILE, append_snapshot, export_json, read_snapshot
+
 
 class NodeType(Enum):
     CHAT = 1
@@ -195,15 +196,14 @@ class Action(Node):
 import os
 
 
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
-
-
 class AssociativeMemory:
     def __init__(self, base_path, do_load=False) -> None:
+        self.base_path = base_path
+        self._clear()
+        if os.path.exists(f"{base_path}/{META_FILE}") and do_load:
+            self.load()
+
+    def _clear(self):
         self.id_to_node: typing.Dict[int, Node] = dict()
 
         self.thought_id_to_node: typing.Dict[int, Thought] = dict()
@@ -215,41 +215,70 @@ class AssociativeMemory:
 
         self.embeddings: dict[int, list[float]] = dict()
 
-        self.base_path = base_path
-        if (
-            os.path.exists(f"{base_path}/embeddings.json")
-            and os.path.exists(f"{base_path}/nodes.json")
-            and do_load
-        ):
-            self._load(base_path)
-
-    def _load(self, base_path):
-        raise NotImplementedError("Not sure if it works")
-        self.embeddings = json.load(open(f"{base_path}/embeddings.json"))
-        saved_nodes = json.load(open(f"{base_path}/nodes.json"))
-        for node in saved_nodes:
-            self.id_to_node[node["id"]] = Node(
-                node["id"],
-                NodeType[node["type"]],
-                node["subject"],
-                node["predicate"],
-                node["object"],
-                node["description"],
-                node["embedding_key"],
-                node["created"],
-                node["expiration"],
+        # Retrieval index: row i describes nodes_without_chat_by_time[i].
+        # Embeddings are stored L2-normalized, so relevance is a plain dot product.
+        self.node_id_to_row: dict[int, int] = dict()
+        self.embedding_matrix: np.ndarray = None  # allocated on first embedding
+        self.importance_scores = np.zeros(0, dtype=np.float32)
+        self.expirations = np.zeros(0, dtype=np.float64)
+        self.always_include = np.zeros(0, dtype=bool)
+
+        self.num_saved_nodes = 0
+
+    def load(self, num_nodes: int = None):
+        """
+        Load the first num_nodes nodes (all if None) of the snapshot in base_path,
+        replacing the current content of the memory.
+        """
+        self._clear()
+        self._load(self.base_path, num_nodes)
+
+    def _load(self, base_path, num_nodes=None):
+        saved_nodes, embeddings = read_snapshot(base_path, num_nodes)
+        for saved_node, embedding in zip(saved_nodes, embeddings):
+            node_type = NodeType[saved_node["type"]]
+            node = self._add(
+                saved_node["subject"],
+                saved_node["predicate"],
+                saved_node["object"],
+                saved_node["description"],
+                node_type,
+                datetime.strptime(saved_node["created"], "%Y-%m-%d %H:%M:%S"),
+                datetime.strptime(saved_node["expiration"], "%Y-%m-%d %H:%M:%S"),
             )
+            assert node.id == saved_node["id"]
+            if node_type == NodeType.CHAT:
+                node.conversation = [tuple(c) for c in saved_node["conversation"]]
+            node.importance_score = saved_node["importance_score"]
+            node.always_include = saved_node["always_include"] == "true"
+            self.set_node_embedding(node.id, embedding)
+        self.num_saved_nodes = len(saved_nodes)
 
     def save(self):
-        json.dump(
-            [node.toJSON() for node in self.id_to_node.values()],
-            open(f"{self.base_path}/nodes.json", "w"),
-        )
-        json.dump(
-            self.embeddings,
-            open(f"{self.base_path}/embeddings.json", "w"),
-            cls=NumpyEncoder,
+        """
+        Append the nodes stored since the last save to the on-disk snapshot.
+        """
+        nodes = []
+        embeddings = []
+        node_id = self.num_saved_nodes + 1
+        # nodes are saved in id order, once their embedding is known
+        while node_id in self.id_to_node and node_id in self.embeddings:
+            nodes.append(self.id_to_node[node_id].toJSON())
+            embeddings.append(np.asarray(self.embeddings[node_id], dtype=np.float32))
+            node_id += 1
+        if len(nodes) == 0:
+            return
+        append_snapshot(
+            self.base_path, nodes, np.stack(embeddings), self.num_saved_nodes
         )
+        self.num_saved_nodes += len(nodes)
+
+    def export_json(self):
+        """
+        Write nodes.json and embeddings.json, as expected by older analysis tools.
+        """
+        self.save()
+        export_json(self.base_path)
 
     def _add(
         self, subject, predicate, obj, description, type, created, expiration
@@ -273,6 +302,7 @@ class AssociativeMemory:
 
         if type != NodeType.CHAT:
             self.nodes_without_chat_by_time.append(node)
+            self._add_retrieval_row(node)
 
         self.id_to_node[id] = node
 
@@ -308,18 +338,69 @@ class AssociativeMemory:
             subject, predicate, obj, description, NodeType.ACTION, created, expiration
         )
 
-    def get_nodes_for_retrieval(self, current_time: datetime) -> list[Node]:
+    def _add_retrieval_row(self, node: Node):
+        row = len(self.node_id_to_row)
+        self.node_id_to_row[node.id] = row
+        if row >= len(self.expirations):
+            capacity = max(64, 2 * len(self.expirations))
+            self.importance_scores = np.resize(self.importance_scores, capacity)
+            self.expirations = np.resize(self.expirations, capacity)
+            self.always_include = np.resize(self.always_include, capacity)
+            if self.embedding_matrix is not None:
+                self.embedding_matrix = np.resize(
+                    self.embedding_matrix, (capacity, self.embedding_matrix.shape[1])
+                )
+        self.importance_scores[row] = 0.0
+        self.expirations[row] = node.expiration.timestamp()
+        self.always_include[row] = False
+        if self.embedding_matrix is not None:
+            self.embedding_matrix[row] = 0.0
+
+    def get_retrieval_arrays(
+        self, current_time: datetime
+    ) -> tuple[list[Node], np.ndarray, np.ndarray, np.ndarray]:
         """
-        Get all nodes except chat
+        Get the non-expired nodes (except chat) together with their normalized
+        embeddings, importance scores and always_include flags, in insertion order.
         """
-        nodes = []
-        for node in self.nodes_without_chat_by_time:
-            if node.expiration > current_time:
-                nodes.append(node)
-        return nodes
+        num_rows = len(self.node_id_to_row)
+        rows = np.flatnonzero(self.expirations[:num_rows] > current_time.timestamp())
+        nodes = [self.nodes_without_chat_by_time[i] for i in rows]
+        if self.embedding_matrix is None:
+            embeddings = np.zeros((len(rows), 0), dtype=np.float32)
+        else:
+            embeddings = self.embedding_matrix[rows]
+        return (
+            nodes,
+            embeddings,
+            self.importance_scores[rows],
+            self.always_include[rows],
+        )
 
     def get_node_embedding(self, node_id: int):
         return self.embeddings[node_id]
 
     def set_node_embedding(self, node_id: int, embedding: list[float]):
+        """
+        Store the embedding of a node. The store component calls this last, once
+        the importance score and always_include flag are final, so they are
+        copied into the retrieval index here as well.
+        """
         self.embeddings[node_id] = embedding
+        if node_id not in self.node_id_to_row:
+            return  # chats are not retrieved
+
+        row = self.node_id_to_row[node_id]
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        if self.embedding_matrix is None:
+            self.embedding_matrix = np.zeros(
+                (len(self.expirations), vec.shape[0]), dtype=np.float32
+            )
+        self.embedding_matrix[row] = vec
+
+        node = self.id_to_node[node_id]
+        self.importance_scores[row] = getattr(node, "importance_score", 0.0)
+        self.always_include[row] = node.always_include
@@ -12,3 +12,10 @@ class Scratch:
             saved_info = json.load(open(f"{base_path}/scratch.json", "r"))
             for key, value in saved_info.items():
                 setattr(self, key, value)
+
+    def state_dict(self) -> dict:
+        return {k: v for k, v in vars(self).items() if k != "base_path"}
+
+    def load_state_dict(self, state: dict):
+        for key, value in state.items():
+            setattr(self, key, value)
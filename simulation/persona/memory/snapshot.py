@@ -0,0 +1,148 @@
+"""
+Append-only on-disk format of the associative memory.
+
+A persona directory contains:
+- nodes.jsonl: one JSON object per node (Node.toJSON), in id order
+- embeddings.f32: raw float32 embeddings, one row per line of nodes.jsonl
+- memory_meta.json: number of committed nodes, embedding dimension and
+  the committed byte length of nodes.jsonl
+
+The meta file is replaced atomically after the data files are appended, so
+bytes past the committed lengths (e.g. from a crash mid-save) are ignored on
+load and overwritten by the next save.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+NODES_FILE = "nodes.jsonl"
+EMBEDDINGS_FILE = "embeddings.f32"
+META_FILE = "memory_meta.json"
+
+
+def _empty_meta() -> dict:
+    return {"num_nodes": 0, "dim": None, "nodes_bytes": 0}
+
+
+def read_meta(base_path: str) -> dict:
+    path = os.path.join(base_path, META_FILE)
+    if not os.path.exists(path):
+        return _empty_meta()
+    return json.load(open(path, "r"))
+
+
+def _write_meta(base_path: str, meta: dict):
+    path = os.path.join(base_path, META_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+
+def _open_for_append(path: str, committed_bytes: int):
+    f = open(path, "r+b" if os.path.exists(path) else "w+b")
+    f.truncate(committed_bytes)
+    f.seek(committed_bytes)
+    return f
+
+
+def append_snapshot(
+    base_path: str, nodes: list[dict], embeddings: np.ndarray, start: int
+):
+    """
+    Append nodes and their embeddings (one row per node) to the snapshot.
+
+    `start` is the number of nodes the caller has already saved; 0 starts a new
+    snapshot, discarding any previous one in base_path.
+    """
+    if len(nodes) == 0:
+        return
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    assert embeddings.shape[0] == len(nodes)
+
+    meta = read_meta(base_path) if start > 0 else _empty_meta()
+    if meta["num_nodes"] < start:
+        raise ValueError(
+            f"Snapshot in {base_path} has {meta['num_nodes']} nodes, expected {start}"
+        )
+    elif meta["num_nodes"] > start:
+        # resumed from an earlier checkpoint, drop the nodes saved after it
+        with open(os.path.join(base_path, NODES_FILE), "rb") as f:
+            lines = f.read(meta["nodes_bytes"]).splitlines(keepends=True)
+        meta["nodes_bytes"] = sum(len(line) for line in lines[:start])
+        meta["num_nodes"] = start
+    if meta["dim"] is None:
+        meta["dim"] = int(embeddings.shape[1])
+    elif meta["dim"] != embeddings.shape[1]:
+        raise ValueError(
+            f"Embedding dimension {embeddings.shape[1]} does not match snapshot"
+            f" dimension {meta['dim']}"
+        )
+
+    lines = "".join(json.dumps(node) + "\n" for node in nodes).encode("utf-8")
+    with _open_for_append(
+        os.path.join(base_path, NODES_FILE), meta["nodes_bytes"]
+    ) as f:
+        f.write(lines)
+    with _open_for_append(
+        os.path.join(base_path, EMBEDDINGS_FILE),
+        meta["num_nodes"] * meta["dim"] * 4,
+    ) as f:
+        f.write(embeddings.tobytes())
+
+    meta["num_nodes"] += len(nodes)
+    meta["nodes_bytes"] += len(lines)
+    _write_meta(base_path, meta)
+
+
+def read_snapshot(
+    base_path: str, num_nodes: int = None
+) -> tuple[list[dict], np.ndarray]:
+    """
+    Read the committed part of a snapshot, or only its first num_nodes nodes.
+    Embeddings are memory-mapped, not copied.
+    """
+    meta = read_meta(base_path)
+    if num_nodes is None:
+        num_nodes = meta["num_nodes"]
+    elif num_nodes > meta["num_nodes"]:
+        raise ValueError(
+            f"Snapshot in {base_path} has {meta['num_nodes']} nodes, requested {num_nodes}"
+        )
+    if num_nodes == 0:
+        return [], np.zeros((0, meta["dim"] or 0), dtype=np.float32)
+
+    with open(os.path.join(base_path, NODES_FILE), "rb") as f:
+        data = f.read(meta["nodes_bytes"])
+    nodes = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+    embeddings = np.memmap(
+        os.path.join(base_path, EMBEDDINGS_FILE),
+        dtype=np.float32,
+        mode="r",
+        shape=(meta["num_nodes"], meta["dim"]),
+    )
+    return nodes[:num_nodes], embeddings[:num_nodes]
+
+
+def export_json(base_path: str):
+    """
+    Write the legacy nodes.json/embeddings.json files from a snapshot.
+    """
+    nodes, embeddings = read_snapshot(base_path)
+    json.dump(nodes, open(os.path.join(base_path, "nodes.json"), "w"))
+    json.dump(
+        {node["id"]: embedding.tolist() for node, embedding in zip(nodes, embeddings)},
+        open(os.path.join(base_path, "embeddings.json"), "w"),
+    )
+
+
+if __name__ == "__main__":
+    # python -m simulation.persona.memory.snapshot <run or persona dir> ...
+    for path in sys.argv[1:]:
+        for root, _, files in os.walk(path):
+            if META_FILE in files:
+                export_json(root)
+                print(f"Exported {root}")
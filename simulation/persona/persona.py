@@ -98,5 +98,23 @@ class PersonaAgent:
         self.act.add_reference_to_other_persona(persona)
         self.converse.add_reference_to_other_persona(persona)
 
+    def state_dict(self) -> dict:
+        """
+        State needed to resume the persona. The memory is saved first, so the
+        state only records how many of its nodes belong to this checkpoint.
+        """
+        self.memory.save()
+        return {
+            "memory_num_nodes": self.memory.num_saved_nodes,
+            "scratch": self.scratch.state_dict(),
+            "current_time": getattr(self, "current_time", None),
+        }
+
+    def load_state_dict(self, state: dict):
+        self.memory.load(state["memory_num_nodes"])
+        self.scratch.load_state_dict(state["scratch"])
+        if state["current_time"] is not None:
+            self.current_time = state["current_time"]
+
     def loop(self, obs: PersonaOberservation) -> PersonaAction:
         raise NotImplementedError("needs to be implemented in subclass")
@@ -1 +1,2 @@
 from .environment import *
+from .stepping import step_agents
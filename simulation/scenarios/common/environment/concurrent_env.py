@@ -1,3 +1,4 @@
+import copy
 import math
 from datetime import datetime, timedelta
 
@@ -178,6 +179,44 @@ class ConcurrentEnv:
             state = self._observe_home(agent)
         return state
 
+    def concurrent_phases(self) -> list[str]:
+        """
+        Phases in which the agents act independently of each other, so that their
+        `loop` can run in parallel before the environment is stepped.
+        """
+        return [self.POOL_LOCATION, "pool_after_harvesting", "home"]
+
+    def _placeholder_action(self, agent) -> PersonaAction:
+        if self.phase == self.POOL_LOCATION:
+            return PersonaActionHarvesting(agent, self.POOL_LOCATION, 0)
+        elif self.phase == "pool_after_harvesting":
+            return PersonaAction(agent, self.POOL_LOCATION)
+        return PersonaAction(agent, "home")
+
+    def observe_phase(self) -> list[tuple[str, HarvestingObs]]:
+        """
+        Observations of the agents left in the current (concurrent) phase, in
+        stepping order, as a sequential run would produce them.
+
+        The steps of these phases only touch the stepping agent and do not depend
+        on the action content, so a copy of the environment is stepped with
+        placeholder actions to get the observation of each following agent.
+        """
+        assert self.phase in self.concurrent_phases()
+        shadow = copy.copy(self)
+        shadow.internal_global_state = copy.deepcopy(self.internal_global_state)
+        shadow._agent_selector = copy.deepcopy(self._agent_selector)
+        shadow._phase_selector = copy.deepcopy(self._phase_selector)
+        shadow.rewards = dict(self.rewards)
+        shadow.df_acc = []
+        observations = [(self.agent_selection, self._observe(self.agent_selection))]
+        while not shadow._agent_selector.is_last():
+            agent, obs, _, _ = shadow.step(
+                shadow._placeholder_action(shadow.agent_selection)
+            )
+            observations.append((agent, obs))
+        return observations
+
     def close(self):
         """
         Close should release any graphical displays, subprocesses, network connections
@@ -235,6 +274,16 @@ class ConcurrentEnv:
 
         return self.agent_selection, self._observe(self.agent_selection)
 
+    def state_dict(self) -> dict:
+        """
+        State needed to resume the environment, including its random generator.
+        """
+        return {k: v for k, v in vars(self).items() if k != "experiment_storage"}
+
+    def load_state_dict(self, state: dict):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def save_log(self):
         pd.concat(self.df_acc).to_json(
             f"{self.experiment_storage}/log_env.json", orient="records"
@@ -0,0 +1,46 @@
+from concurrent.futures import Executor
+
+from simulation.persona.common import PersonaAction
+from simulation.utils import WandbLogger
+
+from .environment import ConcurrentEnv, HarvestingObs
+
+
+def step_agents(
+    env: ConcurrentEnv,
+    personas: dict,
+    agent_id: str,
+    obs: HarvestingObs,
+    executor: Executor = None,
+    logger: WandbLogger = None,
+) -> list[tuple[PersonaAction, str, HarvestingObs, dict, dict]]:
+    """
+    Run the agent(s) whose turn it is and step the environment with their actions.
+
+    Without an executor, or in a phase where the agents interact, only the current
+    agent is run. Otherwise the `loop` of every agent left in the phase runs on the
+    executor, and the environment is then stepped in the usual agent order, so the
+    environment log is the same as in a sequential run.
+
+    Returns:
+        One (action, agent_id, obs, rewards, termination) tuple per `env.step`
+    """
+    if executor is None or env.phase not in env.concurrent_phases():
+        action = personas[agent_id].loop(obs)
+        return [(action, *env.step(action))]
+
+    observations = env.observe_phase()
+    observations[0] = (agent_id, obs)
+    if logger is not None:
+        # log the span of the previous (sequential) agent before the workers start
+        logger.flush_agent_span()
+
+    def loop(agent_id, obs):
+        action = personas[agent_id].loop(obs)
+        if logger is not None:
+            logger.flush_agent_span()
+        return action
+
+    futures = [executor.submit(loop, agent_id, obs) for agent_id, obs in observations]
+    actions = [future.result() for future in futures]
+    return [(action, *env.step(action)) for action in actions]
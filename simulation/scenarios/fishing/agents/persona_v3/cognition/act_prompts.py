@@ -47,6 +47,7 @@ def prompt_action_choose_amount_of_fish_to_catch(
         lm = model.find(
             lm,
             regex=r"\d+",
+            constrained=model.constrained_find,
             default_value="0",
             stop_regex=f"tons",
             name="option",
@@ -150,6 +150,7 @@ def prompt_find_harvesting_limit_from_conversation(
         lm = model.find(
             lm,
             regex=r"\d+",
+            constrained=model.constrained_find,
             default_value="-1",
             name="num_resource",
         )
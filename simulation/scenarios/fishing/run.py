@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 import numpy as np
@@ -6,8 +7,14 @@ from omegaconf import DictConfig, OmegaConf
 
 from simulation.persona import EmbeddingModel
 from simulation.persona.common import PersonaIdentity
-from simulation.utils import ModelWandbWrapper
-
+from simulation.utils import (
+    ModelWandbWrapper,
+    has_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+from ..common import step_agents
 from .environment import FishingConcurrentEnv, FishingPerturbationEnv
 
 
@@ -18,6 +25,8 @@ def run(
     framework_wrapper: ModelWandbWrapper,
     embedding_model: EmbeddingModel,
     experiment_storage: str,
+    resume: bool = False,
+    num_workers: int = 1,
 ):
     if cfg.agent.agent_package == "persona_v3":
         from .agents.persona_v3 import FishingPersona
@@ -83,45 +92,63 @@ def run(
     else:
         raise ValueError(f"Unknown environment class: {cfg.env.class_name}")
     agent_id, obs = env.reset()
-
-    while True:
-        agent = personas[agent_id]
-        action = agent.loop(obs)
-
-        (
-            agent_id,
-            obs,
-            rewards,
-            termination,
-        ) = env.step(action)
-
-        stats = {}
-        STATS_KEYS = [
-            "conversation_resource_limit",
-            *[f"persona_{i}_collected_resource" for i in range(5)],
-        ]
-        for s in STATS_KEYS:
-            if s in action.stats:
-                stats[s] = action.stats[s]
-
-        if np.any(list(termination.values())):
-            logger.log_game(
-                {
-                    "num_resource": obs.current_resource_num,
-                    **stats,
-                },
-                last_log=True,
-            )
-            break
-        else:
-            logger.log_game(
-                {
-                    "num_resource": obs.current_resource_num,
-                    **stats,
-                }
+    if resume and has_checkpoint(experiment_storage):
+        # continue after the last completed round
+        agent_id, obs = load_checkpoint(
+            experiment_storage, env, personas, logger, [*wrappers, framework_wrapper]
+        )
+    last_round = env.num_round
+
+    # agents of the independent phases run concurrently when num_workers > 1
+    executor = ThreadPoolExecutor(num_workers) if num_workers > 1 else None
+    terminated = False
+    while not terminated:
+        steps = step_agents(env, personas, agent_id, obs, executor, logger)
+
+        for action, agent_id, obs, rewards, termination in steps:
+            stats = {}
+            STATS_KEYS = [
+                "conversation_resource_limit",
+                *[f"persona_{i}_collected_resource" for i in range(5)],
+            ]
+            for s in STATS_KEYS:
+                if s in action.stats:
+                    stats[s] = action.stats[s]
+
+            if np.any(list(termination.values())):
+                logger.log_game(
+                    {
+                        "num_resource": obs.current_resource_num,
+                        **stats,
+                    },
+                    last_log=True,
+                )
+                terminated = True
+                break
+            else:
+                logger.log_game(
+                    {
+                        "num_resource": obs.current_resource_num,
+                        **stats,
+                    }
+                )
+
+            logger.save(experiment_storage, agent_name_to_id)
+
+        # every env.step of the batch is applied, checkpoint at the last one
+        if not terminated and env.num_round > last_round:
+            last_round = env.num_round
+            save_checkpoint(
+                experiment_storage,
+                env,
+                personas,
+                logger,
+                [*wrappers, framework_wrapper],
+                agent_id,
+                obs,
             )
-
-        logger.save(experiment_storage, agent_name_to_id)
+    if executor is not None:
+        executor.shutdown()
 
     env.save_log()
     for persona in personas:
@@ -50,6 +50,7 @@ def prompt_action_choose_amount_of_pollution(
         lm = model.find(
             lm,
             regex=r"\d+",
+            constrained=model.constrained_find,
             default_value="0",
             stop_regex=f"tons",
             name="option",
@@ -48,6 +48,7 @@ def prompt_action_choose_amount_of_grass(
         lm = model.find(
             lm,
             regex=r"\d+",
+            constrained=model.constrained_find,
             default_value="0",
             stop_regex=f"tons",
             name="option",
@@ -1,2 +1,4 @@
 from .logger import *
 from .models import *
+from .checkpoint import *
+from .response_cache import *
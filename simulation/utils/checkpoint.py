@@ -0,0 +1,71 @@
+import os
+import pickle
+import random
+import sys
+
+import numpy as np
+
+CHECKPOINT_FILE = "checkpoint.pkl"
+
+
+def _get_rng_state() -> dict:
+    state = {"random": random.getstate(), "numpy": np.random.get_state()}
+    if "torch" in sys.modules:
+        state["torch"] = sys.modules["torch"].get_rng_state()
+    return state
+
+
+def _set_rng_state(state: dict):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    if "torch" in state and "torch" in sys.modules:
+        sys.modules["torch"].set_rng_state(state["torch"])
+
+
+def save_checkpoint(
+    experiment_storage: str, env, personas: dict, logger, wrappers: list, agent_id, obs
+):
+    """
+    Save everything needed to continue the simulation from the next agent step:
+    environment, persona memories and scratch, LLM wrapper seeds, logger step and
+    the global random generators.
+    """
+    state = {
+        "env": env.state_dict(),
+        "personas": {k: persona.state_dict() for k, persona in personas.items()},
+        "logger": logger.state_dict(),
+        "wrappers": [wrapper.state_dict() for wrapper in wrappers],
+        "rng": _get_rng_state(),
+        "agent_id": agent_id,
+        "obs": obs,
+    }
+    path = os.path.join(experiment_storage, CHECKPOINT_FILE)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def has_checkpoint(experiment_storage: str) -> bool:
+    return os.path.exists(os.path.join(experiment_storage, CHECKPOINT_FILE))
+
+
+def load_checkpoint(
+    experiment_storage: str, env, personas: dict, logger, wrappers: list
+) -> tuple:
+    """
+    Restore a checkpoint written by save_checkpoint into freshly built objects.
+
+    Returns:
+        tuple: The agent_id and observation the simulation continues with.
+    """
+    with open(os.path.join(experiment_storage, CHECKPOINT_FILE), "rb") as f:
+        state = pickle.load(f)
+
+    env.load_state_dict(state["env"])
+    for k, persona in personas.items():
+        persona.load_state_dict(state["personas"][k])
+    logger.load_state_dict(state["logger"])
+    for wrapper, wrapper_state in zip(wrappers, state["wrappers"]):
+        wrapper.load_state_dict(wrapper_state)
+    _set_rng_state(state["rng"])
+    return state["agent_id"], state["obs"]
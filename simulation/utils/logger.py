@@ -1,6 +1,7 @@
 import datetime
 import logging
 import os
+import threading
 
 import wandb
 
@@ -12,6 +13,19 @@ logger = logging.getLogger("fontTools.subset")
 logger.setLevel(logging.WARNING)
 
 
+class _ChainState(threading.local):
+    """Agent span and chain being recorded by the current thread."""
+
+    def __init__(self) -> None:
+        self.current_agent_name = None
+        self.current_agent_span = None
+        self.current_phase_name = None
+        self.token_usage_agent = 0
+        self.is_finish_pending = False
+        self.chain_error = False
+        self.chain_error_message = ""
+
+
 class WandbLogger:
     def __init__(self, scenario_name, configs, debug=False, tags=[]) -> None:
         run = wandb.init(
@@ -25,72 +39,95 @@ class WandbLogger:
         print(f"Storage name: {run.name}-{run.id}")
         self.run_id = run.id
         self.run_name = run.name
-        self.current_agent_name = None
-        self.current_agent_span = None
-        self.current_phase_name = None
+        self.chain_state = _ChainState()
+        self.lock = threading.RLock()
         self.token_usage = 0
         self.token_usage_in = 0
         self.token_usage_out = 0
         self.start_time_ms = datetime.datetime.now().timestamp() * 1000
 
         self.global_step = 0
-        self.is_finish_pending = False
 
         self.html_logs = {}
 
+    def state_dict(self) -> dict:
+        return {
+            "global_step": self.global_step,
+            "token_usage": self.token_usage,
+            "token_usage_in": self.token_usage_in,
+            "token_usage_out": self.token_usage_out,
+            "html_logs": self.html_logs,
+        }
+
+    def load_state_dict(self, state: dict):
+        # the open agent span belongs to the interrupted run, start a new one
+        self.chain_state = _ChainState()
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def _log_agent_span(self, commit):
+        state = self.chain_state
+        span = state.current_agent_span._span
+        TFS = state.token_usage_agent / ((span.end_time_ms - span.start_time_ms) / 1000)
+        TFS_cumulative = self.token_usage / (
+            (span.end_time_ms - self.start_time_ms) / 1000
+        )
+        t = trace_tree.WBTraceTree(span, state.current_agent_span._model_dict)
+        wandb.log(
+            {
+                "experiment/trace": t,
+                "experiment/TFS": TFS,
+                "experiment/TFS_cumulative": TFS_cumulative,
+                "experiment/token_in_cumulative": self.token_usage_in,
+                "experiment/token_out_cumulative": self.token_usage_out,
+            },
+            step=self.global_step,
+            commit=commit,
+        )
+
     def get_agent_chain(self, agent_name, phase_name):
         start_time_ms = datetime.datetime.now().timestamp() * 1000
+        state = self.chain_state
         if (
-            self.current_agent_name != agent_name
-            or self.current_phase_name != phase_name
+            state.current_agent_name != agent_name
+            or state.current_phase_name != phase_name
         ):
-            if self.current_agent_span is not None:
-                TFS = self.token_usage_agent / (
-                    (
-                        self.current_agent_span._span.end_time_ms
-                        - self.current_agent_span._span.start_time_ms
-                    )
-                    / 1000
-                )
-                TFS_cumulative = self.token_usage / (
-                    (self.current_agent_span._span.end_time_ms - self.start_time_ms)
-                    / 1000
-                )
-                t = trace_tree.WBTraceTree(
-                    self.current_agent_span._span, self.current_agent_span._model_dict
-                )
-                wandb.log(
-                    {
-                        "experiment/trace": t,
-                        "experiment/TFS": TFS,
-                        "experiment/TFS_cumulative": TFS_cumulative,
-                        "experiment/token_in_cumulative": self.token_usage_in,
-                        "experiment/token_out_cumulative": self.token_usage_out,
-                    },
-                    step=self.global_step,
-                    commit=True,
-                )
-                self.global_step += 1
-            self.current_agent_name = agent_name
-            self.current_phase_name = phase_name
-            self.token_usage_agent = 0
-            self.current_agent_span = trace_tree.Trace(
+            self.flush_agent_span()
+            state.current_agent_name = agent_name
+            state.current_phase_name = phase_name
+            state.token_usage_agent = 0
+            state.current_agent_span = trace_tree.Trace(
                 name=agent_name,
                 kind=trace_tree.SpanKind.AGENT,
                 start_time_ms=start_time_ms,
                 inputs={"phase": phase_name},
             )
-        return self.current_agent_span
+        return state.current_agent_span
+
+    def flush_agent_span(self):
+        """
+        Log the agent span of the current thread, if any. Concurrent drivers call
+        this when a worker finishes an agent step, instead of waiting for the
+        thread to switch agent or phase.
+        """
+        state = self.chain_state
+        if state.current_agent_span is not None:
+            with self.lock:
+                self._log_agent_span(commit=True)
+                self.global_step += 1
+        state.current_agent_name = None
+        state.current_phase_name = None
+        state.current_agent_span = None
 
     def start_chain(self, chain_name):
-        assert self.is_finish_pending == False
-        self.is_finish_pending = True
+        assert self.chain_state.is_finish_pending == False
+        self.chain_state.is_finish_pending = True
         start_time_ms = datetime.datetime.now().timestamp() * 1000
         chain = trace_tree.Trace(
             name=chain_name, kind=trace_tree.SpanKind.CHAIN, start_time_ms=start_time_ms
         )
-        self.chain_error = False
-        self.chain_error_message = ""
+        self.chain_state.chain_error = False
+        self.chain_state.chain_error_message = ""
         return chain
 
     def log_trace_llm(
@@ -112,8 +149,8 @@ class WandbLogger:
         model_name,
     ):
         if status == "ERROR":
-            self.chain_error = True
-            self.chain_error_message = f"Error in {name}."
+            self.chain_state.chain_error = True
+            self.chain_state.chain_error_message = f"Error in {name}."
 
         t = trace_tree.Trace(
             name=name,
@@ -137,32 +174,36 @@ class WandbLogger:
             outputs={"response": response_text},
         )
         token_usage = token_usage_in + token_usage_out
-        self.token_usage_in += token_usage_in
-        self.token_usage_out += token_usage_out
-        self.token_usage += token_usage
-        self.token_usage_agent += token_usage
+        with self.lock:
+            self.token_usage_in += token_usage_in
+            self.token_usage_out += token_usage_out
+            self.token_usage += token_usage
+        self.chain_state.token_usage_agent += token_usage
         chain.add_child(t)
 
     def end_chain(self, agent_name, chain_span, html_render):
-        assert self.is_finish_pending == True
-        self.is_finish_pending = False
-        if agent_name != self.current_agent_name:
+        assert self.chain_state.is_finish_pending == True
+        self.chain_state.is_finish_pending = False
+        if agent_name != self.chain_state.current_agent_name:
             raise Exception("Agent name does not match")
-        chain_agent = self.current_agent_span
+        chain_agent = self.chain_state.current_agent_span
         end_time_ms = datetime.datetime.now().timestamp() * 1000
         chain_span._span.end_time_ms = end_time_ms
         chain_agent._span.end_time_ms = end_time_ms
         chain_span._span.add_named_result(
             inputs={}, outputs={"html_render": html_render}
         )
-        if agent_name not in self.html_logs:
-            self.html_logs[agent_name] = []
-        self.html_logs[agent_name].append(f"<h3>{chain_span.name}</h3>\n{html_render}")
-        if self.chain_error:
+        with self.lock:
+            if agent_name not in self.html_logs:
+                self.html_logs[agent_name] = []
+            self.html_logs[agent_name].append(
+                f"<h3>{chain_span.name}</h3>\n{html_render}"
+            )
+        if self.chain_state.chain_error:
             chain_span._span.status_code = "ERROR"
-            chain_span._span.status_message = self.chain_error_message
+            chain_span._span.status_message = self.chain_state.chain_error_message
             chain_agent._span.status_code = "ERROR"
-            chain_agent._span.status_message = self.chain_error_message
+            chain_agent._span.status_message = self.chain_state.chain_error_message
 
         chain_agent.add_child(chain_span)
 
@@ -184,29 +225,7 @@ class WandbLogger:
             # weasyprint.HTML(string=html).write_pdf(path)
 
     def log_game(self, kwargs, last_log=False):
-        if last_log and self.current_agent_span is not None:
-            TFS = self.token_usage_agent / (
-                (
-                    self.current_agent_span._span.end_time_ms
-                    - self.current_agent_span._span.start_time_ms
-                )
-                / 1000
-            )
-            TFS_cumulative = self.token_usage / (
-                (self.current_agent_span._span.end_time_ms - self.start_time_ms) / 1000
-            )
-            t = trace_tree.WBTraceTree(
-                self.current_agent_span._span, self.current_agent_span._model_dict
-            )
-            wandb.log(
-                {
-                    "experiment/trace": t,
-                    "experiment/TFS": TFS,
-                    "experiment/TFS_cumulative": TFS_cumulative,
-                    "experiment/token_in_cumulative": self.token_usage_in,
-                    "experiment/token_out_cumulative": self.token_usage_out,
-                },
-                step=self.global_step,
-                commit=False,
-            )
-        wandb.log(kwargs, step=self.global_step, commit=last_log)
+        with self.lock:
+            if last_log and self.chain_state.current_agent_span is not None:
+                self._log_agent_span(commit=False)
+            wandb.log(kwargs, step=self.global_step, commit=last_log)
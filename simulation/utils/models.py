@@ -1,12 +1,20 @@
 import re
+import threading
 import traceback
 import warnings
 from datetime import datetime
 
 import pathfinder
-from pathfinder import Model
+from pathfinder.pathfinder.backend import PathFinder
 
 from .logger import WandbLogger
+from .response_cache import ResponseCache
+
+
+class _ChainState(threading.local):
+    agent_chain = None
+    chain = None
+    agent_name = None
 
 
 class ModelWandbWrapper:
@@ -19,17 +27,75 @@ class ModelWandbWrapper:
         top_p,
         seed,
         is_api=False,
+        response_cache: ResponseCache = None,
+        constrained_find=False,
     ) -> None:
         self.base_lm = base_lm
         self.render = render
         self.wanbd_logger = wanbd_logger
 
-        self.agent_chain = None
-        self.chain = None
+        # personas sharing a wrapper may run their chains on different threads
+        self.chain_state = _ChainState()
         self.temperature = temperature
         self.top_p = top_p
         self.seed = seed
+        # calls made by each agent, its seeds follow its own calls whatever the
+        # order in which concurrent agents run
+        self.agent_calls = {}
+        self._seed_lock = threading.Lock()
         self.is_api = is_api
+        self.response_cache = response_cache
+        # passed by the act/reflect prompts to the finds of their numeric answers
+        self.constrained_find = constrained_find
+
+    @property
+    def agent_chain(self):
+        return self.chain_state.agent_chain
+
+    @agent_chain.setter
+    def agent_chain(self, value):
+        self.chain_state.agent_chain = value
+
+    @property
+    def chain(self):
+        return self.chain_state.chain
+
+    @chain.setter
+    def chain(self, value):
+        self.chain_state.chain = value
+
+    def state_dict(self) -> dict:
+        return {"seed": self.seed, "agent_calls": dict(self.agent_calls)}
+
+    def load_state_dict(self, state: dict):
+        self.seed = state["seed"]
+        self.agent_calls = dict(state.get("agent_calls", {}))
+
+    def _next_seed(self) -> int:
+        """Seed of the next call of the agent running the current chain."""
+        agent_name = self.chain_state.agent_name
+        with self._seed_lock:
+            calls = self.agent_calls.get(agent_name, 0)
+            self.agent_calls[agent_name] = calls + 1
+        return self.seed + calls
+
+    def _call(self, previous_lm: PathFinder, op: str, params: dict, call):
+        """
+        Run call(), i.e. previous_lm + a pathfinder primitive, unless the response
+        cache already holds its result.
+
+        Returns:
+            tuple: The resulting lm and whether it was served from the cache.
+        """
+        if self.response_cache is None or not self.response_cache.enabled:
+            return call(), False
+        key = self.response_cache.key(op, previous_lm, params)
+        lm = self.response_cache.get(key, previous_lm)
+        if lm is not None:
+            return lm, True
+        lm = call()
+        self.response_cache.put(key, previous_lm, lm)
+        return lm, False
 
     def start_chain(
         self,
@@ -37,6 +103,7 @@ class ModelWandbWrapper:
         phase_name,
         query_name,
     ):
+        self.chain_state.agent_name = agent_name
         self.agent_chain = self.wanbd_logger.get_agent_chain(agent_name, phase_name)
         self.chain = self.wanbd_logger.start_chain(phase_name + "::" + query_name)
         return self.base_lm
@@ -77,7 +144,7 @@ class ModelWandbWrapper:
 
     def gen(
         self,
-        previous_lm: Model,
+        previous_lm: PathFinder,
         name=None,
         default_value="",
         *,
@@ -90,6 +157,7 @@ class ModelWandbWrapper:
     ):
         start_time_ms = datetime.now().timestamp() * 1000
         prompt = previous_lm._current_prompt()
+        seed = self._next_seed()
 
         if temperature is None:
             temperature = self.temperature
@@ -97,14 +165,30 @@ class ModelWandbWrapper:
         if top_p is None:
             top_p = 1.0
 
+        cached = False
         try:
-            lm: Model = previous_lm + pathfinder.gen(
-                name=name,
-                max_tokens=max_tokens,
-                stop_regex=stop_regex,
-                temperature=temperature,
-                top_p=top_p,
-                save_stop_text=save_stop_text,
+            lm, cached = self._call(
+                previous_lm,
+                "gen",
+                {
+                    "name": name,
+                    "max_tokens": max_tokens,
+                    "stop_regex": stop_regex,
+                    "save_stop_text": save_stop_text,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    # identical prompts collapse only when decoding is greedy
+                    "seed": seed if temperature != 0.0 else None,
+                },
+                lambda: previous_lm
+                + pathfinder.gen(
+                    name=name,
+                    max_tokens=max_tokens,
+                    stop_regex=stop_regex,
+                    temperature=temperature,
+                    top_p=top_p,
+                    save_stop_text=save_stop_text,
+                ),
             )
             res = lm[name]
         except Exception as e:
@@ -130,20 +214,19 @@ class ModelWandbWrapper:
                 system_message="TODO",
                 prompt=prompt,
                 status="SUCCESS",
-                status_message=f"valid: {True}",
+                status_message="cache hit" if cached else f"valid: {True}",
                 response_text=res,
                 temperature=temperature,
                 top_p=top_p,
-                token_usage_in=lm.token_in,
-                token_usage_out=lm.token_out,
+                token_usage_in=0 if cached else lm.token_in,
+                token_usage_out=0 if cached else lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
             return lm
 
     def find(
         self,
-        previous_lm: Model,
+        previous_lm: PathFinder,
         name=None,
         default_value="",
         *,
@@ -152,9 +235,11 @@ class ModelWandbWrapper:
         stop_regex=None,
         temperature=None,
         top_p=None,
+        constrained=False,
     ):
         start_time_ms = datetime.now().timestamp() * 1000
         prompt = previous_lm._current_prompt()
+        seed = self._next_seed()
 
         if temperature is None:
             temperature = self.temperature
@@ -162,14 +247,32 @@ class ModelWandbWrapper:
         if top_p is None:
             top_p = 1.0
 
+        cached = False
         try:
-            lm: Model = previous_lm + pathfinder.find(
-                name=name,
-                max_tokens=max_tokens,
-                regex=regex,
-                stop_regex=stop_regex,
-                temperature=temperature,
-                top_p=top_p,
+            lm, cached = self._call(
+                previous_lm,
+                "find",
+                {
+                    "name": name,
+                    "max_tokens": max_tokens,
+                    "regex": regex,
+                    "stop_regex": stop_regex,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "seed": seed if temperature != 0.0 else None,
+                    # keeps the keys of finds cached before constrained existed
+                    **({"constrained": True} if constrained else {}),
+                },
+                lambda: previous_lm
+                + pathfinder.find(
+                    name=name,
+                    max_tokens=max_tokens,
+                    regex=regex,
+                    stop_regex=stop_regex,
+                    temperature=temperature,
+                    top_p=top_p,
+                    constrained=constrained,
+                ),
             )
             res = lm[name]
         except Exception as e:
@@ -195,15 +298,14 @@ class ModelWandbWrapper:
                 system_message="TODO",
                 prompt=prompt,
                 status="SUCCESS",
-                status_message=f"valid: {True}",
+                status_message="cache hit" if cached else f"valid: {True}",
                 response_text=res,
                 temperature=temperature,
                 top_p=top_p,
-                token_usage_in=lm.token_in,
-                token_usage_out=lm.token_out,
+                token_usage_in=0 if cached else lm.token_in,
+                token_usage_out=0 if cached else lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
             return lm
 
     def select(
@@ -212,16 +314,30 @@ class ModelWandbWrapper:
         options,
         default_value=None,
         name=None,
+        scoring="greedy",
         # No sampling by select, since is used more as parsing previous generated text
     ):
         start_time_ms = datetime.now().timestamp() * 1000
         prompt = previous_lm._current_prompt()
 
         error_message = None
+        cached = False
         try:
-            lm: Model = previous_lm + pathfinder.select(
-                options=options,
-                name=name,
+            lm, cached = self._call(
+                previous_lm,
+                "select",
+                {
+                    "name": name,
+                    "options": list(options),
+                    # keeps the keys of greedy selects cached before scoring existed
+                    **({} if scoring == "greedy" else {"scoring": scoring}),
+                },
+                lambda: previous_lm
+                + pathfinder.select(
+                    options=options,
+                    name=name,
+                    scoring=scoring,
+                ),
             )
             res = lm[name]
         except Exception as e:
@@ -248,14 +364,15 @@ class ModelWandbWrapper:
                 prompt=prompt,
                 status="SUCCESS" if error_message is None else "ERROR",
                 status_message=(
-                    f"valid: {True}" if error_message is None else error_message
+                    ("cache hit" if cached else f"valid: {True}")
+                    if error_message is None
+                    else error_message
                 ),
                 response_text=res,
                 temperature=0.0,
                 top_p=1.0,
-                token_usage_in=lm.token_in,
-                token_usage_out=lm.token_out,
+                token_usage_in=0 if cached else lm.token_in,
+                token_usage_out=0 if cached else lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
             return lm
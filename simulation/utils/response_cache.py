@@ -0,0 +1,159 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from pathfinder.pathfinder.backend import PathFinder
+
+CACHE_MODES = ("bypass", "read_only", "read_write")
+
+_MISSING = object()
+
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses for ModelWandbWrapper.
+
+    An entry is keyed on the model name, the rendered prompt, the pending
+    consume-on-demand text of the backend and the parameters of the gen/find/select
+    call. It stores how the call changed the lm (new chat text, variables and
+    backend attributes), so a hit is replayed without calling the backend.
+
+    Modes:
+    - bypass: never read or write
+    - read_only: serve hits, do not store new responses
+    - read_write: serve hits and store new responses
+    """
+
+    def __init__(self, path: str, mode: str = "read_write") -> None:
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.db = None
+        if mode != "bypass":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses"
+                " (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self.db.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "bypass"
+
+    def key(self, op: str, previous_lm: PathFinder, params: dict) -> str:
+        block = PathFinder.open_block
+        data = [
+            op,
+            previous_lm.model_name,
+            previous_lm._current_prompt(),
+            previous_lm.text_to_consume,
+            previous_lm.prefix_text,
+            # whether the call opens a new chat block
+            None if block is None else [block.role, block.init_tag],
+            getattr(previous_lm, "seed", None),
+            params,
+        ]
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str, previous_lm: PathFinder) -> PathFinder:
+        """
+        Return previous_lm with the cached call applied, or None on a miss.
+        """
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return self._apply(previous_lm, json.loads(row[0]))
+
+    def put(self, key: str, previous_lm: PathFinder, lm: PathFinder):
+        if self.db is None or self.mode == "read_only":
+            return
+        try:
+            value = json.dumps(self._diff(previous_lm, lm))
+        except TypeError:
+            return  # variables that cannot be stored, skip caching
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+            self.db.commit()
+
+    @staticmethod
+    def _diff(previous_lm: PathFinder, lm: PathFinder) -> dict:
+        if isinstance(lm.chat, list):
+            chat = {"entries": lm.chat[max(len(previous_lm.chat) - 1, 0) :]}
+        elif isinstance(previous_lm.chat, str):
+            chat = {"suffix": lm.chat[len(previous_lm.chat) :]}
+        else:
+            chat = {"text": lm.chat}
+        variables = {
+            k: v
+            for k, v in lm._variables.items()
+            if previous_lm._variables.get(k, _MISSING) != v
+        }
+        attributes = {
+            k: v
+            for k, v in vars(lm).items()
+            if k not in ("chat", "_chat", "_chat_view", "_variables")
+            and isinstance(v, (str, int, float, bool, type(None)))
+            and getattr(previous_lm, k, _MISSING) != v
+        }
+        return {"chat": chat, "variables": variables, "attributes": attributes}
+
+    @staticmethod
+    def _apply(previous_lm: PathFinder, value: dict) -> PathFinder:
+        lm = previous_lm.copy()
+        chat = value["chat"]
+        if "entries" in chat:
+            entries = copy.deepcopy(chat["entries"])
+            base = lm.chat[: max(len(previous_lm.chat) - 1, 0)]
+            if (
+                len(base) + len(entries) > len(previous_lm.chat)
+                and PathFinder.open_block is not None
+            ):
+                # the call opened a new block, as previous_lm + gen(...) would
+                PathFinder.open_block.init_tag = False
+            lm.chat = base + entries
+        elif "suffix" in chat:
+            lm.chat = lm.chat + chat["suffix"]
+        else:
+            lm.chat = chat["text"]
+        lm._variables.update(value["variables"])
+        for k, v in value["attributes"].items():
+            setattr(lm, k, v)
+        return lm
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
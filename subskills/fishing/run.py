@@ -2,6 +2,7 @@ import json
 import os
 import shutil
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import hydra
 import numpy as np
@@ -14,7 +15,7 @@ from transformers import set_seed
 
 import wandb
 from simulation.persona.common import PersonaIdentity
-from simulation.utils import ModelWandbWrapper, WandbLogger
+from simulation.utils import ModelWandbWrapper, ResponseCache, WandbLogger
 from pathfinder import get_model
 
 
@@ -36,6 +37,9 @@ def main(cfg: DictConfig):
     )
     os.makedirs(experiment_storage, exist_ok=True)
 
+    if cfg.batch_size > 1 and cfg.llm.backend == "vllm" and not cfg.llm.is_api:
+        model.enable_batching(max_batch_size=cfg.batch_size)
+
     wrapper = ModelWandbWrapper(
         model,
         render=cfg.llm.render,
@@ -44,6 +48,11 @@ def main(cfg: DictConfig):
         top_p=cfg.llm.top_p,
         seed=cfg.seed,
         is_api=cfg.llm.is_api,
+        response_cache=ResponseCache(
+            cfg.response_cache.path
+            or os.path.join(os.path.dirname(__file__), "./.cache/responses.sqlite"),
+            mode=cfg.response_cache.mode,
+        ),
     )
 
     if cfg.llm.out_format == "freeform":
@@ -78,37 +87,46 @@ def main(cfg: DictConfig):
         def __init__(self, name) -> None:
             self.name = name
 
+        def run_instance(self, args):
+            try:
+                answer, html_prompt = self.prompt(**args)
+                passed, correct_answer = self.pass_condition(answer, **args)
+                return {
+                    "args": self.serialize_args(args),
+                    "answer": answer,
+                    "passed": passed,
+                    "correct_answer": correct_answer,
+                    "error": "OK",
+                    "html_prompt": html_prompt,
+                }
+            except Exception as e:
+                print(f"Error: {e}")
+                _, correct_answer = self.pass_condition(0, **args)
+                return {
+                    "args": self.serialize_args(args),
+                    "answer": None,
+                    "correct_answer": correct_answer,
+                    "passed": False,
+                    "error": f"Error: {e}",
+                    "html_prompt": "parse_error",
+                }
+
+        def run_instance_in_batch(self, args):
+            log = self.run_instance(args)
+            logger.flush_agent_span()
+            return log
+
         def run(
             self,
         ):
-            logs = []
-            for args in self.get_args_iterator():
-                try:
-                    answer, html_prompt = self.prompt(**args)
-                    passed, correct_answer = self.pass_condition(answer, **args)
-                    logs.append(
-                        {
-                            "args": self.serialize_args(args),
-                            "answer": answer,
-                            "passed": passed,
-                            "correct_answer": correct_answer,
-                            "error": "OK",
-                            "html_prompt": html_prompt,
-                        }
-                    )
-                except Exception as e:
-                    print(f"Error: {e}")
-                    _, correct_answer = self.pass_condition(0, **args)
-                    logs.append(
-                        {
-                            "args": self.serialize_args(args),
-                            "answer": None,
-                            "correct_answer": correct_answer,
-                            "passed": False,
-                            "error": f"Error: {e}",
-                            "html_prompt": "parse_error",
-                        }
-                    )
+            args_list = list(self.get_args_iterator())
+            if cfg.batch_size > 1:
+                # all the prompts are submitted at once, vLLM generates them in one
+                # batch and API requests are bounded by the model's max_concurrency
+                with ThreadPoolExecutor(cfg.batch_size) as executor:
+                    logs = list(executor.map(self.run_instance_in_batch, args_list))
+            else:
+                logs = [self.run_instance(args) for args in args_list]
 
             ALPHA = 0.05
             ci = smprop.proportion_confint(
@@ -517,6 +535,10 @@ def main(cfg: DictConfig):
     for test_case in tqdm.tqdm(test_cases):
         test_case.run()
 
+    if wrapper.response_cache.enabled:
+        print(f"Response cache: {wrapper.response_cache.stats()}")
+    wrapper.response_cache.close()
+
 
 if __name__ == "__main__":
     OmegaConf.register_resolver("uuid", lambda: f"run_{uuid.uuid4()}")